@@ -4,21 +4,25 @@ Interface utilisateur interactive pour le pipeline RAG + HITL
 """
 
 import streamlit as st
+import asyncio
+import hashlib
+import io
 import json
 from pathlib import Path
 from typing import Optional
 import sys
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Ajouter le répertoire du projet au path
 sys.path.insert(0, str(Path(__file__).parent))
 
-from src.document_processor import DocumentProcessor
-from src.rag_engine import RAGEngine
-from src.extractor import FinancialExtractor
-from src.qa_engine import QAEngine
-from src.hitl_manager import HITLManager
-from src.memory_manager import MemoryManager
-from src.config import Config
+# Les imports src.* (et leurs dépendances lourdes: langchain, faiss...) sont
+# faits paresseusement dans initialize_agent() pour que les reruns Streamlit
+# ne repayent pas le coût d'import à chaque interaction.
 
 
 # Configuration Streamlit
@@ -29,54 +33,40 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# CSS personnalisé
-st.markdown("""
-    <style>
-    .main-header {
-        font-size: 2.5rem;
-        font-weight: bold;
-        margin-bottom: 1rem;
-    }
-    .section-header {
-        font-size: 1.8rem;
-        font-weight: bold;
-        margin-top: 2rem;
-        margin-bottom: 1rem;
-        border-bottom: 2px solid #1f77b4;
-        padding-bottom: 0.5rem;
-    }
-    .success-box {
-        background-color: #d4edda;
-        border: 1px solid #c3e6cb;
-        color: #155724;
-        padding: 1rem;
-        border-radius: 0.5rem;
-        margin: 1rem 0;
-    }
-    .warning-box {
-        background-color: #fff3cd;
-        border: 1px solid #ffeaa7;
-        color: #856404;
-        padding: 1rem;
-        border-radius: 0.5rem;
-        margin: 1rem 0;
-    }
-    .error-box {
-        background-color: #f8d7da;
-        border: 1px solid #f5c6cb;
-        color: #721c24;
-        padding: 1rem;
-        border-radius: 0.5rem;
-        margin: 1rem 0;
-    }
-    </style>
-    """, unsafe_allow_html=True)
-
-
-@st.cache_resource
+# CSS personnalisé servi en statique (static/app.css): une balise <link>
+# par rerun au lieu de renvoyer tout le bloc CSS sur le websocket
+st.markdown(
+    '<link rel="stylesheet" href="app/static/app.css">',
+    unsafe_allow_html=True
+)
+
+
+def _env_fingerprint() -> str:
+    """Empreinte du fichier .env (clés API, etc.)
+
+    Sert à invalider le cache de l'agent quand les secrets changent,
+    sans le reconstruire sur un simple hot-reload du script.
+    """
+    env_file = Path(".env")
+    if env_file.exists():
+        return hashlib.md5(env_file.read_bytes()).hexdigest()
+    return ""
+
+
+@st.cache_resource(
+    show_spinner=False,
+    # comps vaut None après une init échouée: invalider pour retenter
+    validate=lambda comps: comps is not None and comps.get('env_fingerprint') == _env_fingerprint()
+)
 def initialize_agent():
     """Initialise l'agent financier avec cache"""
     try:
+        from src.config import Config
+        from src.document_processor import DocumentProcessor
+        from src.hitl_manager import HITLManager
+        from src.memory_manager import MemoryManager
+        from src.rag_engine import RAGEngine
+
         config = Config()
         memory = MemoryManager(config.memory_path)
         
@@ -87,46 +77,89 @@ def initialize_agent():
             'rag_engine': RAGEngine(config, memory),
             'extractor': None,  # Sera initialisé après le RAG
             'qa_engine': None,  # Sera initialisé après le RAG
-            'hitl': HITLManager(config, memory)
+            'hitl': HITLManager(config, memory),
+            'env_fingerprint': _env_fingerprint()
         }
-        
+
         return agent_components
     except Exception as e:
         st.error(f"Erreur lors de l'initialisation: {e}")
         return None
 
 
+def dumps_json(obj) -> str:
+    """Sérialise en JSON indenté (orjson, en Rust, si disponible)"""
+    if orjson is not None:
+        return orjson.dumps(
+            obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+        ).decode()
+    return json.dumps(obj, indent=2, ensure_ascii=False)
+
+
+def loads_json(data: bytes):
+    """Désérialise du JSON (orjson si disponible)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+@st.cache_data(ttl=5)
+def path_exists(path_str: str) -> bool:
+    """Vérifie l'existence d'un fichier avec un cache court
+
+    Évite un stat() par rerun (coûteux sur stockage réseau/bind mount).
+    """
+    return Path(path_str).exists()
+
+
+@st.cache_data(ttl=30)
+def load_memory_file(path_str: str, mtime_ns: int):
+    """
+    Charge un journal mémoire JSONL avec cache
+
+    Le mtime du fichier fait partie de la clé de cache: le contenu n'est
+    relu sur disque que s'il a changé (ou après expiration du TTL).
+    """
+    return [
+        loads_json(line)
+        for line in Path(path_str).read_bytes().splitlines()
+        if line.strip()
+    ]
+
+
 def display_extraction_results(result: dict):
     """Affiche les résultats d'extraction de manière structurée"""
+    # Déstructurer une seule fois (tolère aussi les valeurs None)
+    sheet = result.get("sheet") or {}
+    missing = result.get("missing_fields") or []
+    additional_info = result.get("additional_information") or []
+    confidence = result.get("confidence_score", 0)
+
     col1, col2, col3 = st.columns(3)
-    
+
     with col1:
-        confidence = result.get("confidence_score", 0)
         st.metric("Score de confiance", f"{confidence:.2%}", f"{confidence:.4f}")
-    
+
     with col2:
-        extracted = len(result.get("sheet", {}))
-        st.metric("Champs extraits", extracted)
-    
+        st.metric("Champs extraits", len(sheet))
+
     with col3:
-        missing = len(result.get("missing_fields", []))
-        st.metric("Champs manquants", missing)
-    
+        st.metric("Champs manquants", len(missing))
+
     # Afficher les données extraites
-    if result.get("sheet"):
+    if sheet:
         st.subheader("Données Extraites")
-        data_df = json.dumps(result.get("sheet"), indent=2, ensure_ascii=False)
-        st.json(result.get("sheet"))
-    
+        st.json(sheet)
+
     # Afficher les champs manquants
-    if result.get("missing_fields"):
+    if missing:
         with st.expander("Champs manquants", expanded=False):
-            st.write(", ".join(result.get("missing_fields")))
-    
+            st.write(", ".join(missing))
+
     # Afficher les informations supplémentaires
-    if result.get("additional_information"):
+    if additional_info:
         with st.expander("Informations supplémentaires", expanded=False):
-            for info in result.get("additional_information"):
+            for info in additional_info:
                 st.write(f"- {info}")
 
 
@@ -146,11 +179,12 @@ def display_qa_results(answer: dict):
         validation_status = "Requise" if needs_validation else "Validée"
         st.metric("Validation", validation_status)
     
-    # Afficher les sources
+    # Afficher les sources (dédupliquées en une passe, ordre d'apparition)
     sources = answer.get("sources", [])
     if sources:
-        with st.expander(f"Sources ({len(set(sources))} document(s))", expanded=False):
-            for i, source in enumerate(set(sources), 1):
+        unique_sources = list(dict.fromkeys(sources))
+        with st.expander(f"Sources ({len(unique_sources)} document(s))", expanded=False):
+            for i, source in enumerate(unique_sources, 1):
                 st.write(f"{i}. {source}")
 
 
@@ -159,16 +193,15 @@ def main():
     st.markdown("<div class='main-header'>Agent Financier RAG + HITL</div>", unsafe_allow_html=True)
     st.markdown("Extraction et analyse de données financières avec validation humaine")
     
-    # Initialiser la session
-    if 'agent' not in st.session_state:
-        st.session_state.agent = initialize_agent()
-    
-    if st.session_state.agent is None:
+    # Récupérer l'agent persistant (st.cache_resource: une seule
+    # initialisation par processus, pas de copie figée en session_state
+    # qui survivrait à une invalidation du cache)
+    agent = initialize_agent()
+
+    if agent is None:
         st.error("Impossible d'initialiser l'application")
         return
     
-    agent = st.session_state.agent
-    
     # Barre latérale avec navigation
     st.sidebar.markdown("## Navigation")
     page = st.sidebar.radio(
@@ -235,32 +268,30 @@ def main():
             # Bouton de traitement
             if st.button("Lancer l'extraction", key="extract_button"):
                 with st.spinner("Traitement des documents..."):
-                    # Sauvegarder les fichiers temporairement
-                    temp_dir = Path("temp_uploads")
-                    temp_dir.mkdir(exist_ok=True)
-                    
-                    file_paths = []
-                    for uploaded_file in uploaded_files:
-                        file_path = temp_dir / uploaded_file.name
-                        with open(file_path, "wb") as f:
-                            f.write(uploaded_file.getbuffer())
-                        file_paths.append(str(file_path))
-                    
                     try:
-                        # Traiter les documents
-                        documents = agent['doc_processor'].process_documents(file_paths)
+                        # Traiter les documents directement depuis la mémoire
+                        # (pas d'aller-retour disque via un dossier temporaire)
+                        documents = agent['doc_processor'].process_streams(
+                            [(f.name, f.getvalue()) for f in uploaded_files]
+                        )
                         
                         # Indexer les documents
                         agent['rag_engine'].index_documents(documents)
                         
                         # Initialiser les moteurs d'extraction et Q&A
+                        from src.extractor import FinancialExtractor
+                        from src.qa_engine import QAEngine
+
                         if agent['extractor'] is None:
                             agent['extractor'] = FinancialExtractor(agent['config'], agent['rag_engine'])
                         if agent['qa_engine'] is None:
                             agent['qa_engine'] = QAEngine(agent['config'], agent['rag_engine'])
                         
-                        # Extraire les données
-                        extraction_result = agent['extractor'].extract(documents)
+                        # Extraire les données (appels LLM bloquants déportés
+                        # hors du thread de script Streamlit)
+                        extraction_result = asyncio.run(
+                            asyncio.to_thread(agent['extractor'].extract, documents)
+                        )
                         
                         # Sauvegarder le résultat
                         st.session_state.last_extraction = extraction_result
@@ -280,23 +311,28 @@ def main():
                             # Interface de validation
                             st.subheader("Validation et Corrections")
                             
-                            # Afficher les champs pour validation
+                            # Afficher les champs pour validation dans un seul
+                            # data_editor: un payload unique au lieu de N
+                            # text_input re-rendus à chaque frappe
+                            import pandas as pd
+
                             data = extraction_result.get("sheet", {})
-                            corrections = {}
-                            
-                            for field, value in data.items():
-                                col1, col2 = st.columns([3, 1])
-                                with col1:
-                                    corrected_value = st.text_input(
-                                        f"Corrigez si nécessaire: {field}",
-                                        value=str(value),
-                                        key=f"field_{field}"
-                                    )
-                                    if corrected_value != str(value):
-                                        corrections[field] = corrected_value
-                                
-                                with col2:
-                                    st.write(f"Valeur: {value}")
+
+                            df = pd.DataFrame(
+                                list(data.items()), columns=["field", "value"]
+                            )
+                            edited = st.data_editor(
+                                df,
+                                num_rows="fixed",
+                                disabled=["field"],
+                                hide_index=True,
+                                key="corrections_editor"
+                            )
+                            corrections = {
+                                row.field: row.value
+                                for row in edited.itertuples()
+                                if str(row.value) != str(data[row.field])
+                            }
                             
                             # Bouton validation
                             if st.button("Valider et enregistrer"):
@@ -311,24 +347,18 @@ def main():
                         else:
                             st.markdown("<div class='success-box'>✓ Extraction validée automatiquement</div>", unsafe_allow_html=True)
                         
-                        # Télécharger les résultats
+                        # Télécharger les résultats (payload binaire: évite
+                        # la copie str->bytes conservée en session par widget)
                         st.subheader("Exporter les résultats")
-                        json_str = json.dumps(extraction_result, ensure_ascii=False, indent=2)
                         st.download_button(
                             "Télécharger les résultats (JSON)",
-                            json_str,
+                            io.BytesIO(dumps_json(extraction_result).encode("utf-8")),
                             "extraction_results.json",
                             "application/json"
                         )
                         
                     except Exception as e:
                         st.markdown(f"<div class='error-box'>Erreur: {e}</div>", unsafe_allow_html=True)
-                    
-                    finally:
-                        # Nettoyer les fichiers temporaires
-                        import shutil
-                        if temp_dir.exists():
-                            shutil.rmtree(temp_dir)
         else:
             st.info("Veuillez charger au moins un fichier PDF ou JSON")
     
@@ -337,7 +367,7 @@ def main():
         st.markdown("<div class='section-header'>Questions et Réponses</div>", unsafe_allow_html=True)
         
         # Vérifier que l'index RAG est chargé
-        if st.session_state.agent['rag_engine'].vectorstore is None:
+        if agent['rag_engine'].vectorstore is None:
             st.warning("Veuillez d'abord charger et indexer les documents dans la page 'Extraction'")
             st.stop()
         
@@ -353,11 +383,15 @@ def main():
                 with st.spinner("Recherche en cours..."):
                     try:
                         # Initialiser QA si pas déjà fait
+                        from src.qa_engine import QAEngine
+
                         if agent['qa_engine'] is None:
                             agent['qa_engine'] = QAEngine(agent['config'], agent['rag_engine'])
                         
-                        # Obtenir la réponse
-                        answer = agent['qa_engine'].answer(question)
+                        # Obtenir la réponse (requête LLM hors du thread de script)
+                        answer = asyncio.run(
+                            asyncio.to_thread(agent['qa_engine'].answer, question)
+                        )
                         st.session_state.last_answer = answer
                         
                         # Afficher les résultats
@@ -397,11 +431,12 @@ def main():
         
         with col1:
             st.subheader("Corrections d'extraction")
-            corrections_file = Path("memory/extraction_corrections.json")
-            if corrections_file.exists():
-                with open(corrections_file, 'r', encoding='utf-8') as f:
-                    corrections = json.load(f)
-                st.metric("Corrections enregistrées", len(corrections.get("corrections", [])))
+            corrections_file = Path("memory/extraction_corrections.jsonl")
+            if path_exists(str(corrections_file)):
+                corrections = load_memory_file(
+                    str(corrections_file), corrections_file.stat().st_mtime_ns
+                )
+                st.metric("Corrections enregistrées", len(corrections))
                 with st.expander("Voir les corrections"):
                     st.json(corrections)
             else:
@@ -409,11 +444,10 @@ def main():
         
         with col2:
             st.subheader("Corrections Q&A")
-            qa_file = Path("memory/qa_corrections.json")
-            if qa_file.exists():
-                with open(qa_file, 'r', encoding='utf-8') as f:
-                    qa = json.load(f)
-                st.metric("Q&A enregistrées", len(qa.get("qa_corrections", [])))
+            qa_file = Path("memory/qa_corrections.jsonl")
+            if path_exists(str(qa_file)):
+                qa = load_memory_file(str(qa_file), qa_file.stat().st_mtime_ns)
+                st.metric("Q&A enregistrées", len(qa))
                 with st.expander("Voir les Q&A"):
                     st.json(qa)
             else:
@@ -442,29 +476,39 @@ def main():
         
         config = agent['config']
         
+        # Un seul bloc markdown par colonne: un composant frontend par
+        # rendu au lieu d'une boîte st.info par paramètre
         st.subheader("Configuration RAG")
         col1, col2 = st.columns(2)
-        
+
         with col1:
-            st.info(f"**Modèle LLM**: {config.llm_model}")
-            st.info(f"**Température**: {config.llm_temperature}")
-            st.info(f"**Top-K retrieval**: {config.top_k_retrieval}")
-        
+            st.markdown(
+                f"**Modèle LLM**: {config.llm_model}  \n"
+                f"**Température**: {config.llm_temperature}  \n"
+                f"**Top-K retrieval**: {config.top_k_retrieval}"
+            )
+
         with col2:
-            st.info(f"**Modèle embedding**: {config.embedding_model}")
-            st.info(f"**Chunk size**: {config.chunk_size}")
-            st.info(f"**Chunk overlap**: {config.chunk_overlap}")
-        
+            st.markdown(
+                f"**Modèle embedding**: {config.embedding_model}  \n"
+                f"**Chunk size**: {config.chunk_size}  \n"
+                f"**Chunk overlap**: {config.chunk_overlap}"
+            )
+
         st.subheader("Paramètres de validation")
         col1, col2 = st.columns(2)
-        
+
         with col1:
-            st.info(f"**Seuil validation obligatoire**: {config.require_validation_below:.2%}")
-            st.info(f"**Seuil auto-validation**: {config.auto_validate_above:.2%}")
-        
+            st.markdown(
+                f"**Seuil validation obligatoire**: {config.require_validation_below:.2%}  \n"
+                f"**Seuil auto-validation**: {config.auto_validate_above:.2%}"
+            )
+
         with col2:
-            st.info(f"**Seuil confiance**: {config.confidence_threshold:.2%}")
-            st.info(f"**Champs critiques**: {len(config.extraction_schema)} champs")
+            st.markdown(
+                f"**Seuil confiance**: {config.confidence_threshold:.2%}  \n"
+                f"**Champs critiques**: {len(config.extraction_schema)} champs"
+            )
 
 
 if __name__ == "__main__":
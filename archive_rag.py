@@ -4,6 +4,9 @@ Script pour archiver (sauvegarder) l'index RAG
 
 import sys
 import io
+import itertools
+import multiprocessing
+import os
 from pathlib import Path
 
 # Configurer l'encodage UTF-8 pour Windows
@@ -53,12 +56,20 @@ def archive_rag():
         for doc_path in existing_docs:
             print(f"      - {Path(doc_path).name}")
         
-        documents = doc_processor.process_documents(existing_docs)
+        # Parser les PDF en parallèle (une tâche par fichier, CPU-bound),
+        # avec cache Parquet: les fichiers inchangés sautent le parsing
+        n_workers = max(1, min(len(existing_docs), (os.cpu_count() or 2) - 1))
+        if n_workers > 1:
+            with multiprocessing.Pool(n_workers) as pool:
+                docs_nested = pool.map(doc_processor.process_single_cached, existing_docs)
+        else:
+            docs_nested = [doc_processor.process_single_cached(p) for p in existing_docs]
+        documents = list(itertools.chain.from_iterable(docs_nested))
         print(f"   ✓ {len(documents)} documents traités\n")
         
-        # Indexation et archivage
+        # Indexation et archivage (IVF-PQ: recherche sous-linéaire sur gros corpus)
         print("🔍 Indexation et archivage dans la base RAG...")
-        rag_engine.index_documents(documents, save_to_disk=True)
+        rag_engine.index_documents_ivfpq(documents, save_to_disk=True)
         
         print("\n✅ Archivage terminé!")
         print(f"   📁 Index sauvegardé dans: {config.rag_index_path}")
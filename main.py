@@ -3,23 +3,28 @@ Agent d'extraction financière avec RAG et HITL - Version GPT-4
 Point d'entrée principal du système
 """
 
+import sys
 from pathlib import Path
 from typing import Optional
-import json
-
-from src.document_processor import DocumentProcessor
-from src.rag_engine import RAGEngine
-from src.extractor import FinancialExtractor
-from src.qa_engine import QAEngine
-from src.hitl_manager import HITLManager
-from src.memory_manager import MemoryManager
+
+from src import json_utils
 from src.config import Config
 
+# Les composants (langchain, faiss, PyMuPDF...) sont importés paresseusement
+# dans FinancialAgent.__init__: importer main.py reste quasi instantané.
+
 
 class FinancialAgent:
     """Agent principal orchestrant tout le pipeline"""
-    
+
     def __init__(self, config_path: Optional[str] = None):
+        from src.document_processor import DocumentProcessor
+        from src.extractor import FinancialExtractor
+        from src.hitl_manager import HITLManager
+        from src.memory_manager import MemoryManager
+        from src.qa_engine import QAEngine
+        from src.rag_engine import RAGEngine
+
         self.config = Config(config_path)
         self.memory = MemoryManager(self.config.memory_path)
         self.doc_processor = DocumentProcessor(self.config)
@@ -27,7 +32,12 @@ class FinancialAgent:
         self.extractor = FinancialExtractor(self.config, self.rag_engine)
         self.qa_engine = QAEngine(self.config, self.rag_engine)
         self.hitl = HITLManager(self.config, self.memory)
-        
+
+        # Cache des réponses de la session (questions littéralement répétées)
+        self._answer_cache: dict = {}
+        self._answer_cache_max = 256
+
+
     def process_documents(self, document_paths: list[str]) -> dict:
         """
         Pipeline complet: ingestion -> extraction -> validation -> correction
@@ -86,8 +96,7 @@ class FinancialAgent:
         
         # Sauvegarder le résultat
         output_path = self.config.output_path / f"extraction_{final_result['timestamp']}.json"
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(final_result, f, indent=2, ensure_ascii=False)
+        json_utils.dump_file(output_path, final_result)
         
         print(f"   OK: Résultat sauvegardé: {output_path}\n")
         return final_result
@@ -102,26 +111,38 @@ class FinancialAgent:
         Returns:
             Réponse avec score de confiance et sources
         """
+        # Court-circuit: question identique déjà posée dans cette session
+        cache_key = " ".join(question.lower().split())
+        if cache_key in self._answer_cache:
+            return self._answer_cache[cache_key]
+
         # Recherche dans la mémoire des corrections
         historical_answer = self.memory.search_similar_question(question)
         if historical_answer:
             print(f"\nQuestion: {question}")
             print("   Réponse trouvée dans l'historique des corrections")
-            return historical_answer
-        
+            return self._cache_answer(cache_key, historical_answer)
+
         # Génération de la réponse via RAG
         result = self.qa_engine.answer(question)
-        
+
         # Validation si confiance faible
         if result["confidence"] < self.config.confidence_threshold:
             validated = self.hitl.validate_qa_response(question, result)
-            
+
             if validated.get("corrected"):
                 self.memory.store_qa_correction(question, result, validated)
-                return validated
-            
-            return validated
-        
+                return self._cache_answer(cache_key, validated)
+
+            return self._cache_answer(cache_key, validated)
+
+        return self._cache_answer(cache_key, result)
+
+    def _cache_answer(self, cache_key: str, result: dict) -> dict:
+        """Mémorise une réponse de session (éviction FIFO au-delà du cap)"""
+        if len(self._answer_cache) >= self._answer_cache_max:
+            self._answer_cache.pop(next(iter(self._answer_cache)))
+        self._answer_cache[cache_key] = result
         return result
     
     def add_manual_context(self, context_data: dict):
@@ -132,6 +153,8 @@ class FinancialAgent:
             context_data: Dictionnaire avec informations supplémentaires
         """
         self.rag_engine.add_manual_context(context_data)
+        # Le nouveau contexte peut changer les réponses: invalider le cache
+        self._answer_cache.clear()
         print("OK: Contexte manuel ajouté à la base RAG")
     
     def _display_extraction(self, result: dict):
@@ -197,19 +220,27 @@ def main():
             
             # Afficher la réponse seulement si elle n'a pas déjà été affichée par HITL
             if not answer.get('validated_by_human'):
-                print("\n" + "-"*80)
-                print(f"Réponse:")
-                print(f"   {answer.get('answer', 'Aucune réponse disponible')}")
-                print(f"\nConfiance: {answer.get('confidence', 0):.2%}")
-                
+                # Une seule écriture stdout par réponse au lieu d'un print
+                # (et d'un flush) par ligne
+                lines = [
+                    "",
+                    "-"*80,
+                    "Réponse:",
+                    f"   {answer.get('answer', 'Aucune réponse disponible')}",
+                    "",
+                    f"Confiance: {answer.get('confidence', 0):.2%}",
+                ]
+
                 sources = answer.get('sources', [])
                 if sources:
-                    unique_sources = list(set(sources))
-                    print(f"Sources: {len(unique_sources)} document(s)")
+                    unique_sources = list(dict.fromkeys(sources))
+                    lines.append(f"Sources: {len(unique_sources)} document(s)")
                     for i, source in enumerate(unique_sources[:3], 1):  # Limiter à 3 sources
-                        print(f"   {i}. {source}")
-                
-                print("-"*80 + "\n")
+                        lines.append(f"   {i}. {source}")
+
+                lines.append("-"*80 + "\n")
+                sys.stdout.write("\n".join(lines) + "\n")
+                sys.stdout.flush()
             else:
                 # Si validé par HITL, afficher un résumé final
                 if answer.get('corrected'):
@@ -29,11 +29,19 @@ def main():
     print("\\nAppuyez sur Ctrl+C pour arrêter\\n")
     
     # Lancer Streamlit
+    # En production, désactiver le watcher de fichiers (un thread qui
+    # scanne tout le projet en continu), le navigateur automatique et la
+    # télémétrie. STREAMLIT_DEV=1 réactive le rechargement à chaud.
+    cmd = [sys.executable, "-m", "streamlit", "run", str(app_file)]
+    if not os.environ.get("STREAMLIT_DEV"):
+        cmd += [
+            "--server.fileWatcherType", "none",
+            "--server.headless", "true",
+            "--browser.gatherUsageStats", "false",
+        ]
+
     try:
-        subprocess.run(
-            [sys.executable, "-m", "streamlit", "run", str(app_file)],
-            cwd=str(app_dir)
-        )
+        subprocess.run(cmd, cwd=str(app_dir))
     except KeyboardInterrupt:
         print("\\n\\nArrêt de l'application.")
     except Exception as e:
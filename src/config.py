@@ -4,9 +4,13 @@ Configuration centralisée du système
 
 from pathlib import Path
 from typing import Optional
-import json
 from datetime import datetime
 
+from src import json_utils
+
+# Répertoires déjà créés dans ce processus (évite un mkdir par rerun)
+_CREATED_DIRS: set = set()
+
 
 class Config:
     """Gestion de la configuration du système"""
@@ -19,10 +23,13 @@ class Config:
         self.output_path = self.base_dir / "outputs"
         self.memory_path = self.base_dir / "memory"
         self.rag_index_path = self.base_dir / "rag_index"  # Dossier pour l'index RAG
-        
-        # Créer les répertoires
-        for path in [self.data_dir, self.output_path, self.memory_path, self.rag_index_path]:
-            path.mkdir(exist_ok=True)
+        self.cache_dir = self.base_dir / "cache"  # Cache des documents parsés
+
+        # Créer les répertoires (une seule fois par processus)
+        for path in [self.data_dir, self.output_path, self.memory_path, self.rag_index_path, self.cache_dir]:
+            if path not in _CREATED_DIRS:
+                path.mkdir(exist_ok=True)
+                _CREATED_DIRS.add(path)
         
         # Charger la config depuis fichier si fourni
         if config_path:
@@ -43,6 +50,14 @@ class Config:
         self.chunk_overlap = 200
         self.top_k_retrieval = 5
         self.embedding_model = "text-embedding-3-small"  # OpenAI
+        self.embed_batch_size = 128  # Chunks par appel d'embedding à l'ingestion
+        self.rag_nprobe = 8  # Cellules IVF sondées par requête (index IVF-PQ)
+        self.rag_ef_search = 64  # Largeur de recherche HNSW (latence vs rappel)
+        self.index_quantization = "fp32"  # "fp32" (HNSW), "sq8" (int8) ou "pq" (produit)
+        self.similarity_threshold = 0.6  # Similarité cosinus min (index produit scalaire)
+        self.semantic_cache_threshold = 0.95  # Similarité cosinus min pour servir une réponse en cache
+        self.max_ctx_chars = 4000  # Taille max d'un extrait dans un contexte LLM
+        self.context_token_budget = 3000  # Budget total de tokens de contexte par prompt
         
         # Extraction Configuration
         self.confidence_threshold = 0.7
@@ -51,6 +66,7 @@ class Config:
         # HITL Configuration
         self.auto_validate_above = 0.9  # Validation auto si confiance > 0.9
         self.require_validation_below = 0.6  # HITL obligatoire si < 0.6
+        self.interactive_mode = "batch"  # "batch" ($EDITOR) ou "per_field" (prompts)
         
         # Schema d'extraction (structure cible)
         self.extraction_schema = {
@@ -72,15 +88,76 @@ class Config:
         self.corrections_file = self.memory_path / "corrections.json"
         self.qa_memory_file = self.memory_path / "qa_memory.json"
         self.context_file = self.memory_path / "manual_context.json"
+
+        # Index inverse des alias + automate de recherche multi-motifs
+        self._build_alias_index()
     
     def _load_config(self, config_path: str):
         """Charge la config depuis un fichier JSON"""
-        with open(config_path, 'r', encoding='utf-8') as f:
-            config_data = json.load(f)
-        
+        config_data = json_utils.load_file(config_path)
+
         # Mettre à jour les attributs
         for key, value in config_data.items():
             setattr(self, key, value)
+
+        if hasattr(self, 'extraction_schema'):
+            self._build_alias_index()
+
+    def _build_alias_index(self):
+        """
+        Pré-compile les alias du schéma d'extraction
+
+        Construit un index inverse alias -> champ et, si pyahocorasick est
+        disponible, un automate Aho-Corasick: chercher les alias dans un
+        texte devient une seule passe linéaire au lieu de M×N sous-scans.
+        """
+        self._alias_to_field = {
+            alias.lower(): field
+            for field, spec in self.extraction_schema.items()
+            for alias in spec.get("aliases", [])
+        }
+        # Le nom du champ lui-même compte comme motif (certains documents
+        # JSON reprennent directement les clés du schéma)
+        for field in self.extraction_schema:
+            self._alias_to_field.setdefault(field.lower(), field)
+
+        self._alias_automaton = None
+        try:
+            import ahocorasick
+        except ImportError:
+            return
+
+        automaton = ahocorasick.Automaton()
+        for alias, field in self._alias_to_field.items():
+            automaton.add_word(alias, (field, alias))
+        automaton.make_automaton()
+        self._alias_automaton = automaton
+
+    def find_field_matches(self, text: str) -> list[tuple]:
+        """
+        Recherche toutes les occurrences d'alias du schéma dans un texte
+
+        Args:
+            text: Texte à scanner
+
+        Returns:
+            Liste de tuples (position de fin, champ, alias)
+        """
+        text_lower = text.lower()
+
+        if self._alias_automaton is not None:
+            return [
+                (pos, field, alias)
+                for pos, (field, alias) in self._alias_automaton.iter(text_lower)
+            ]
+
+        # Repli sans pyahocorasick: scan par alias
+        matches = []
+        for alias, field in self._alias_to_field.items():
+            pos = text_lower.find(alias)
+            if pos != -1:
+                matches.append((pos + len(alias) - 1, field, alias))
+        return matches
     
     def save_config(self, output_path: str):
         """Sauvegarde la configuration actuelle"""
@@ -88,9 +165,8 @@ class Config:
             k: v for k, v in self.__dict__.items()
             if not k.startswith('_') and not isinstance(v, Path)
         }
-        
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(config_dict, f, indent=2, ensure_ascii=False)
+
+        json_utils.dump_file(output_path, config_dict)
     
     @staticmethod
     def get_timestamp() -> str:
@@ -2,23 +2,65 @@
 Traitement et ingestion des documents PDF
 """
 
+import io
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Dict
-import PyPDF2
+from typing import List, Dict, Optional, Tuple
+import fitz  # PyMuPDF: extraction de texte en code natif (MuPDF)
 from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+try:
+    import ahocorasick  # pyahocorasick: multi-pattern matching en une passe
+except ImportError:
+    ahocorasick = None
+
+# Splitters partagés, keyés par (chunk_size, chunk_overlap): évite de
+# reconstruire les regex de séparation à chaque rerun Streamlit
+_SPLITTER_CACHE: Dict[tuple, RecursiveCharacterTextSplitter] = {}
+
+# Mots-clés de nom de fichier -> type de document
+DOC_TYPE_KEYWORDS = {
+    "2065": "tax_declaration",
+    "liasse": "tax_declaration",
+    "fiscal": "tax_declaration",
+    "2033": "financial_statement",
+    "bilan": "financial_statement",
+    "balance": "financial_statement",
+    "description": "company_description",
+    "présentation": "company_description",
+    "synthétique": "summary_report",
+    "synthetique": "summary_report",
+}
+
 
 class DocumentProcessor:
     """Gestion de l'ingestion et du découpage des documents"""
     
     def __init__(self, config):
         self.config = config
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=config.chunk_size,
-            chunk_overlap=config.chunk_overlap,
-            separators=["\n\n", "\n", ". ", " ", ""]
-        )
+        splitter_key = (config.chunk_size, config.chunk_overlap)
+        if splitter_key not in _SPLITTER_CACHE:
+            _SPLITTER_CACHE[splitter_key] = RecursiveCharacterTextSplitter(
+                chunk_size=config.chunk_size,
+                chunk_overlap=config.chunk_overlap,
+                separators=["\n\n", "\n", ". ", " ", ""]
+            )
+        self.text_splitter = _SPLITTER_CACHE[splitter_key]
+        # Cache des PDF parsés, keyé par empreinte (chemin, mtime, taille)
+        self._cache_dir = Path(config.base_dir) / ".doc_cache"
+
+        # Automate Aho-Corasick: une seule passe sur le nom de fichier
+        # quel que soit le nombre de mots-clés
+        self._doc_type_automaton = None
+        if ahocorasick is not None:
+            automaton = ahocorasick.Automaton()
+            for keyword, doc_type in DOC_TYPE_KEYWORDS.items():
+                automaton.add_word(keyword, doc_type)
+            automaton.make_automaton()
+            self._doc_type_automaton = automaton
     
     def process_documents(self, file_paths: List[str]) -> List[Document]:
         """
@@ -31,70 +73,262 @@ class DocumentProcessor:
             Liste de documents LangChain avec métadonnées
         """
         all_documents = []
-        
+
+        # Parser les fichiers en parallèle (le parsing PDF est CPU-bound et
+        # indépendant par fichier); un fichier en erreur retourne simplement [].
+        # DOC_POOL_SIZE permet de réduire le pool sur disque rotatif, où trop
+        # de lecteurs concurrents dégradent le débit d'E/S.
+        if len(file_paths) > 1:
+            pool_size = int(os.environ.get("DOC_POOL_SIZE") or (os.cpu_count() or 1))
+            max_workers = max(1, min(len(file_paths), pool_size))
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                for docs in executor.map(self.process_single, file_paths):
+                    all_documents.extend(docs)
+            return all_documents
+
         for file_path in file_paths:
-            path = Path(file_path)
-            
-            if not path.exists():
-                print(f"[ATTENTION] Fichier non trouvé: {file_path}")
-                continue
-            
-            if path.suffix.lower() == '.pdf':
-                docs = self._process_pdf(path)
-            elif path.suffix.lower() == '.json':
-                docs = self._process_json(path)
-            else:
-                print(f"[ATTENTION] Format non supporté: {path.suffix}")
-                continue
-            
-            all_documents.extend(docs)
-        
+            all_documents.extend(self.process_single(file_path))
+
         return all_documents
-    
-    def _process_pdf(self, file_path: Path) -> List[Document]:
-        """Extrait et découpe le contenu d'un PDF"""
-        documents = []
-        
+
+    def process_single(self, file_path: str) -> List[Document]:
+        """
+        Traite un seul document (utilisable avec multiprocessing.Pool)
+
+        Args:
+            file_path: Chemin vers le fichier PDF ou JSON
+
+        Returns:
+            Liste de documents LangChain avec métadonnées
+        """
+        path = Path(file_path)
+
+        # Un seul stat() par fichier: sert de test d'existence et alimente
+        # la clé de cache de _process_pdf
         try:
-            with open(file_path, 'rb') as f:
-                pdf_reader = PyPDF2.PdfReader(f)
-                
-                # Extraire le texte de chaque page
-                full_text = ""
-                for page_num, page in enumerate(pdf_reader.pages):
-                    text = page.extract_text()
-                    full_text += f"\n--- Page {page_num + 1} ---\n{text}"
-                
-                # Découper en chunks
-                chunks = self.text_splitter.split_text(full_text)
-                
-                # Créer les documents LangChain
-                for i, chunk in enumerate(chunks):
-                    doc = Document(
-                        page_content=chunk,
+            stat = path.stat()
+        except OSError:
+            print(f"[ATTENTION] Fichier non trouvé: {file_path}")
+            return []
+
+        suffix = path.suffix.lower()
+
+        if suffix == '.pdf':
+            return self._process_pdf(path, stat=stat)
+        elif suffix == '.json':
+            return self._process_json(path)
+        else:
+            print(f"[ATTENTION] Format non supporté: {path.suffix}")
+            return []
+    
+    def process_streams(self, streams: List[Tuple[str, bytes]]) -> List[Document]:
+        """
+        Traite des documents déjà en mémoire (uploads Streamlit)
+
+        Évite l'aller-retour disque: PyMuPDF (fitz) ouvre directement un
+        flux d'octets via stream=.
+
+        Args:
+            streams: Liste de tuples (nom de fichier, contenu en octets)
+
+        Returns:
+            Liste de documents LangChain avec métadonnées
+        """
+        from src import json_utils
+
+        all_documents = []
+
+        for name, data in streams:
+            name_lower = name.lower()
+
+            try:
+                if name_lower.endswith('.pdf'):
+                    with fitz.open(stream=data, filetype="pdf") as pdf:
+                        all_documents.extend(self._split_pdf(pdf, name))
+                elif name_lower.endswith('.json'):
+                    content = self._json_to_text(json_utils.loads(data))
+                    all_documents.append(Document(
+                        page_content=content,
                         metadata={
-                            "source": file_path.name,
-                            "chunk_id": i,
-                            "total_chunks": len(chunks),
-                            "file_type": "pdf",
-                            "doc_type": self._infer_document_type(file_path.name)
+                            "source": name,
+                            "file_type": "json",
+                            "doc_type": "structured_data"
                         }
+                    ))
+                else:
+                    print(f"[ATTENTION] Format non supporté: {name}")
+
+            except Exception as e:
+                print(f"❌ Erreur lors du traitement de {name}: {e}")
+
+        return all_documents
+
+    def process_single_cached(self, file_path: str) -> List[Document]:
+        """
+        Traite un document avec cache disque Parquet
+
+        Le cache est keyé par le hash SHA-256 du contenu du fichier: les
+        documents inchangés sautent entièrement le parsing PDF lors des
+        ré-archivages.
+
+        Args:
+            file_path: Chemin vers le fichier PDF ou JSON
+
+        Returns:
+            Liste de documents LangChain avec métadonnées
+        """
+        import hashlib
+        import json
+
+        path = Path(file_path)
+
+        if not path.exists():
+            print(f"[ATTENTION] Fichier non trouvé: {file_path}")
+            return []
+
+        cache_dir = Path(self.config.cache_dir)
+        content_hash = hashlib.sha256(path.read_bytes()).hexdigest()
+        cache_file = cache_dir / f"{content_hash}.parquet"
+
+        # Relire les chunks depuis le cache si le contenu n'a pas changé
+        if cache_file.exists():
+            try:
+                import pandas as pd
+
+                df = pd.read_parquet(cache_file)
+                return [
+                    Document(
+                        page_content=row.page_content,
+                        metadata=json.loads(row.metadata)
                     )
-                    documents.append(doc)
-        
+                    for row in df.itertuples()
+                ]
+            except Exception as e:
+                print(f"[ATTENTION] Cache illisible pour {path.name}: {e}")
+
+        documents = self.process_single(file_path)
+
+        # Alimenter le cache pour les prochains archivages
+        if documents:
+            try:
+                import pandas as pd
+
+                df = pd.DataFrame({
+                    "page_content": [d.page_content for d in documents],
+                    "metadata": [
+                        json.dumps(d.metadata, ensure_ascii=False)
+                        for d in documents
+                    ]
+                })
+                cache_dir.mkdir(exist_ok=True, parents=True)
+                df.to_parquet(cache_file)
+            except Exception as e:
+                print(f"[ATTENTION] Impossible d'écrire le cache pour {path.name}: {e}")
+
+        return documents
+
+    def _process_pdf(self, file_path: Path, stat=None) -> List[Document]:
+        """Extrait et découpe le contenu d'un PDF (avec cache disque)"""
+        cache_file = self._pdf_cache_file(file_path, stat=stat)
+
+        # Fichier inchangé depuis la dernière session: relire le cache
+        if cache_file is not None and cache_file.exists():
+            try:
+                import pickle
+                with open(cache_file, 'rb') as f:
+                    return pickle.load(f)
+            except Exception:
+                pass  # Cache corrompu: reparser
+
+        try:
+            with fitz.open(file_path) as pdf:
+                documents = self._split_pdf(pdf, file_path.name)
+
         except Exception as e:
             print(f"❌ Erreur lors du traitement de {file_path.name}: {e}")
-        
+            return []
+
+        if cache_file is not None and documents:
+            try:
+                import pickle
+                self._cache_dir.mkdir(exist_ok=True, parents=True)
+                with open(cache_file, 'wb') as f:
+                    pickle.dump(documents, f, protocol=5)
+            except Exception:
+                pass  # Cache non critique
+
+        return documents
+
+    def _pdf_cache_file(self, file_path: Path, stat=None) -> Optional[Path]:
+        """
+        Chemin du fichier de cache pour un PDF donné
+
+        L'empreinte combine chemin, mtime, taille et paramètres de découpage:
+        toute modification du fichier ou de la config invalide le cache.
+        Le résultat d'un stat() déjà fait par l'appelant peut être réutilisé.
+        """
+        import hashlib
+
+        if stat is None:
+            try:
+                stat = file_path.stat()
+            except OSError:
+                return None
+
+        key = hashlib.blake2b(
+            f"{file_path}:{stat.st_mtime_ns}:{stat.st_size}:"
+            f"{self.config.chunk_size}:{self.config.chunk_overlap}".encode()
+        ).hexdigest()[:16]
+
+        return self._cache_dir / f"{key}.pkl"
+
+    def _split_pdf(self, pdf: "fitz.Document", source_name: str) -> List[Document]:
+        """Découpe le texte d'un PDF déjà ouvert en chunks LangChain"""
+        documents = []
+
+        # Extraire le texte de chaque page (accumulation en liste puis join
+        # unique: évite la réallocation quadratique de la concaténation +=).
+        # L'extraction reste séquentielle par page: MuPDF n'est pas
+        # thread-safe au sein d'un même document, et le décodage natif rend
+        # le recouvrement par threads sans intérêt ici.
+        parts = []
+        for page_num, page in enumerate(pdf):
+            parts.append(f"\n--- Page {page_num + 1} ---\n{page.get_text('text')}")
+        full_text = "".join(parts)
+
+        # Découper en chunks
+        chunks = self.text_splitter.split_text(full_text)
+
+        # Métadonnées invariantes calculées une seule fois hors de la boucle;
+        # les chaînes sont internées pour être partagées entre tous les chunks
+        source = sys.intern(source_name)
+        doc_type = sys.intern(self._infer_document_type(source_name))
+        file_type = sys.intern("pdf")
+        total_chunks = len(chunks)
+
+        # Créer les documents LangChain
+        for i, chunk in enumerate(chunks):
+            doc = Document(
+                page_content=chunk,
+                metadata={
+                    "source": source,
+                    "chunk_id": i,
+                    "total_chunks": total_chunks,
+                    "file_type": file_type,
+                    "doc_type": doc_type
+                }
+            )
+            documents.append(doc)
+
         return documents
     
     def _process_json(self, file_path: Path) -> List[Document]:
         """Traite un fichier JSON comme document"""
-        import json
-        
+        from src import json_utils
+
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
+            data = json_utils.load_file(file_path)
+
             # Convertir le JSON en texte structuré
             content = self._json_to_text(data)
             
@@ -113,25 +347,37 @@ class DocumentProcessor:
             print(f"❌ Erreur lors du traitement de {file_path.name}: {e}")
             return []
     
-    def _json_to_text(self, data: dict, prefix: str = "") -> str:
-        """Convertit un JSON en texte structuré pour l'indexation"""
-        lines = []
-        
+    def _json_to_text(self, data: dict, prefix: str = "", out: Optional[list] = None) -> str:
+        """Convertit un JSON en texte structuré pour l'indexation
+
+        L'accumulateur `out` est partagé entre les niveaux de récursion:
+        chaque feuille n'est écrite qu'une fois, sans re-jointures
+        intermédiaires à chaque niveau d'imbrication.
+        """
+        top_level = out is None
+        if top_level:
+            out = []
+
         for key, value in data.items():
             if isinstance(value, dict):
-                lines.append(f"{prefix}{key}:")
-                lines.append(self._json_to_text(value, prefix + "  "))
+                out.append(f"{prefix}{key}:")
+                self._json_to_text(value, prefix + "  ", out)
             elif isinstance(value, list):
-                lines.append(f"{prefix}{key}: {', '.join(map(str, value))}")
+                out.append(f"{prefix}{key}: {', '.join(map(str, value))}")
             else:
-                lines.append(f"{prefix}{key}: {value}")
-        
-        return "\n".join(lines)
+                out.append(f"{prefix}{key}: {value}")
+
+        return "\n".join(out) if top_level else ""
     
     def _infer_document_type(self, filename: str) -> str:
         """Infère le type de document depuis le nom de fichier"""
         filename_lower = filename.lower()
-        
+
+        if self._doc_type_automaton is not None:
+            for _, doc_type in self._doc_type_automaton.iter(filename_lower):
+                return doc_type
+            return "unknown"
+
         if any(kw in filename_lower for kw in ["2065", "liasse", "fiscal"]):
             return "tax_declaration"
         elif any(kw in filename_lower for kw in ["2033", "bilan", "balance"]):
@@ -3,10 +3,53 @@ Extraction structurée des données financières
 """
 
 from typing import List, Dict, Any
-import json
+import hashlib
 import re
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from langchain_core.documents import Document
 
+from src import json_utils
+
+try:
+    from numba import njit  # JIT optionnel pour les scans numériques
+except ImportError:
+    njit = None
+
+
+def _validation_masks(values, confidences):
+    """Noyau numérique de _collect_additional_info
+
+    Calcule en une passe les masques "montant négatif" et "confiance
+    moyenne". Compilé par Numba quand il est installé (l'interpréteur
+    disparaît des boucles internes), sinon exécuté tel quel par NumPy.
+    """
+    negative = values < 0
+    medium = (confidences >= 0.5) & (confidences < 0.8)
+    return negative, medium
+
+
+if njit is not None:
+    _validation_masks = njit(cache=True)(_validation_masks)
+
+# Clôtures markdown autour du JSON renvoyé par le LLM (compilé une fois)
+_FENCE_RE = re.compile(r"```(?:json)?\n?|\n?```")
+
+# Nettoyage des montants en une passe C: espaces (y compris insécables)
+# supprimés, virgule décimale -> point
+_FLOAT_TRANS = str.maketrans({" ": None, " ": None, ",": "."})
+
+# Types de documents pertinents pour l'extraction financière
+_RELEVANT_DOC_TYPES = np.array(
+    ["financial_statement", "tax_declaration", "summary_report"], dtype=object
+)
+
+# Champs de montants signés contrôlés par _collect_additional_info
+_SIGNED_FIN_FIELDS = (
+    "finSales", "finOperationInc", "finFinancialInc", "finProfit",
+    "finBalanceSheet", "finEquity", "finAvailableFunds"
+)
+
 
 class FinancialExtractor:
     """Extraction des données financières avec scores de confiance"""
@@ -14,6 +57,47 @@ class FinancialExtractor:
     def __init__(self, config, rag_engine):
         self.config = config
         self.rag = rag_engine
+
+        # Vues pré-calculées du schéma: évite de re-parcourir
+        # extraction_schema et de re-joindre les alias à chaque champ
+        schema = config.extraction_schema
+        self._field_types = {f: spec["type"] for f, spec in schema.items()}
+        self._field_aliases = {f: spec.get("aliases", []) for f, spec in schema.items()}
+        self._field_queries = {
+            f: f"{f} {' '.join(aliases)}"
+            for f, aliases in self._field_aliases.items()
+        }
+
+        # Contextes déjà joints, clé = identités des documents
+        self._ctx_cache: dict = {}
+
+        # Cache disque des réponses LLM, clé = hash(champ + type + contexte).
+        # Relancer l'extraction sur le même corpus ne recoûte rien en LLM.
+        self._llm_cache_file = config.cache_dir / "extraction_cache.json"
+        self._llm_cache_dirty = False
+        try:
+            self._llm_cache = json_utils.load_file(self._llm_cache_file)
+        except Exception:
+            self._llm_cache = {}
+
+    @staticmethod
+    def _cache_key(*parts: str) -> str:
+        """Clé de cache compacte (blake2b, plus rapide que sha256)"""
+        h = hashlib.blake2b(digest_size=16)
+        for part in parts:
+            h.update(part.encode('utf-8'))
+            h.update(b"|")
+        return h.hexdigest()
+
+    def _save_llm_cache(self):
+        """Écrit le cache LLM sur disque s'il a changé"""
+        if not self._llm_cache_dirty:
+            return
+        try:
+            json_utils.dump_file(self._llm_cache_file, self._llm_cache)
+            self._llm_cache_dirty = False
+        except Exception as e:
+            print(f"⚠️  Impossible de sauvegarder le cache d'extraction: {e}")
     
     def extract(self, documents: List[Document]) -> dict:
         """
@@ -27,16 +111,42 @@ class FinancialExtractor:
         """
         # Récupérer les documents financiers pertinents
         financial_docs = self._get_financial_documents(documents)
-        
-        # Extraire chaque champ
+
+        # Préfiltre lexical: un champ dont ni le nom ni aucun alias
+        # n'apparaît dans le corpus est un échec garanti — inutile de payer
+        # une recherche RAG et un appel LLM pour le constater. L'automate
+        # de Config couvre noms de champs et alias: une seule passe O(N)
+        # sur le corpus, quel que soit le nombre de motifs.
+        fields = self.config.get_all_fields()
+        corpus_text = "\n".join(doc.page_content for doc in financial_docs)
+        present_fields = {f for _, f, _ in self.config.find_field_matches(corpus_text)}
+        candidates = [f for f in fields if f in present_fields]
+
+        # Extraire les champs candidats en un seul appel LLM; repli champ
+        # par champ si la réponse groupée est inexploitable
+        results, shared_context = self._extract_all_fields(financial_docs, candidates)
+
+        # Champs absents de la réponse groupée: repli champ par champ,
+        # en parallèle (chaque appel attend surtout le réseau)
+        remaining = [f for f in candidates if f not in results]
+        if remaining:
+            with ThreadPoolExecutor(max_workers=min(8, len(remaining))) as executor:
+                fallback = executor.map(
+                    lambda f: self._extract_field(
+                        f, financial_docs, shared_context=shared_context
+                    ),
+                    remaining
+                )
+                results.update(zip(remaining, fallback))
+
         extracted_data = {}
         field_confidences = {}
         missing_fields = []
-        
-        for field_name in self.config.get_all_fields():
-            result = self._extract_field(field_name, financial_docs)
-            
-            if result["value"] is not None:
+
+        for field_name in fields:
+            result = results.get(field_name)
+
+            if result is not None and result["value"] is not None:
                 extracted_data[field_name] = result["value"]
                 field_confidences[field_name] = result["confidence"]
             else:
@@ -50,7 +160,10 @@ class FinancialExtractor:
         
         # Collecter les informations additionnelles avec explications
         additional_info = self._collect_additional_info(extracted_data, field_confidences, financial_docs)
-        
+
+        # Persister les réponses LLM obtenues pendant ce run
+        self._save_llm_cache()
+
         return {
             "sheet": extracted_data,
             "confidence_score": round(global_confidence, 4),
@@ -59,66 +172,224 @@ class FinancialExtractor:
         }
     
     def _get_financial_documents(self, documents: List[Document]) -> List[Document]:
-        """Filtre les documents pertinents pour l'extraction financière"""
-        relevant_types = ["financial_statement", "tax_declaration", "summary_report"]
-        
-        financial_docs = [
-            doc for doc in documents
-            if doc.metadata.get("doc_type") in relevant_types
-        ]
-        
+        """Filtre les documents pertinents pour l'extraction financière
+
+        Les doc_type sont rassemblés une fois en tableau NumPy (structure
+        de tableaux plutôt que N dictionnaires), puis filtrés par np.isin:
+        la comparaison se fait en C au lieu d'un lookup Python par document.
+        """
+        # Tableau des types, mis en cache tant que la liste ne change pas.
+        # La référence à la liste est conservée dans l'entrée: comparer
+        # par identité (is) reste sûr, un id() seul peut être réutilisé
+        # par CPython après libération de l'ancienne liste
+        cache = getattr(self, '_doc_types_cache', None)
+        if cache is None or cache[0] is not documents or len(cache[1]) != len(documents):
+            doc_types = np.array(
+                [doc.metadata.get("doc_type") for doc in documents],
+                dtype=object
+            )
+            cache = (documents, doc_types)
+            self._doc_types_cache = cache
+
+        mask = np.isin(cache[1], _RELEVANT_DOC_TYPES)
+        financial_docs = [documents[i] for i in np.flatnonzero(mask)]
+
         # Si aucun doc spécifique, prendre tous les documents
         if not financial_docs:
             financial_docs = documents
-        
+
         return financial_docs
     
-    def _extract_field(self, field_name: str, documents: List[Document]) -> dict:
+    def _extract_all_fields(self, documents: List[Document], fields: List[str]) -> tuple:
+        """
+        Extrait tous les champs demandés en un seul appel LLM
+
+        Une extraction champ par champ coûte N allers-retours LLM et N
+        recherches RAG pour le même corpus. Ici on fait une seule
+        recherche sur l'union des champs et alias, puis un seul prompt
+        qui demande un objet JSON couvrant tout le schéma.
+
+        Args:
+            documents: Documents sources
+            fields: Champs à extraire (sous-ensemble du schéma)
+
+        Returns:
+            Tuple (champ -> {value, confidence, source}, contexte partagé);
+            résultats vides si l'appel groupé échoue, le repli par champ
+            prend alors le relais en réutilisant le contexte
+        """
+        if not fields:
+            return {}, None
+
+        # Une seule recherche sur l'union des champs et alias
+        search_terms = []
+        for field_name in fields:
+            search_terms.append(field_name)
+            search_terms.extend(self._field_aliases[field_name])
+        relevant_docs = self.rag.retrieve(" ".join(search_terms), k=8)
+
+        if not relevant_docs:
+            return {}, None
+
+        context = self._build_extraction_context(relevant_docs)
+
+        cache_key = self._cache_key("batch", ",".join(fields), context)
+        cached = self._llm_cache.get(cache_key)
+        if cached is not None:
+            return dict(cached), context
+
+        prompt = self._build_batch_extraction_prompt(fields, context)
+
+        try:
+            data = self._parse_json_response(self._invoke_json(prompt))
+        except Exception as e:
+            print(f"⚠️  Erreur extraction groupée: {e}")
+            return {}, context
+
+        # Format positionnel [[valeur, confiance, source], ...]: les noms de
+        # champs ne sont pas re-décodés par le LLM, on les réassocie par rang
+        if isinstance(data, list):
+            data = {
+                field: {
+                    "value": row[0] if len(row) > 0 else None,
+                    "confidence": row[1] if len(row) > 1 else 0.0,
+                    "source": row[2] if len(row) > 2 else None
+                }
+                for field, row in zip(fields, data)
+                if isinstance(row, (list, tuple))
+            }
+
+        if not isinstance(data, dict):
+            return {}, context
+
+        results = {}
+        for field_name in fields:
+            entry = data.get(field_name)
+            if not isinstance(entry, dict):
+                continue
+
+            value = entry.get("value")
+            if value is not None:
+                field_type = self._field_types[field_name]
+                value = self._cast_value(value, field_type)
+
+            results[field_name] = {
+                "value": value,
+                "confidence": float(entry.get("confidence", 0.0)),
+                "source": entry.get("source")
+            }
+
+        self._llm_cache[cache_key] = results
+        self._llm_cache_dirty = True
+        return results, context
+
+    def _build_batch_extraction_prompt(self, fields: List[str], context: str) -> str:
+        """Construit le prompt d'extraction groupée (tous les champs)"""
+        field_lines = []
+        for field_name in fields:
+            spec = self.config.extraction_schema[field_name]
+            aliases = ', '.join(spec.get("aliases", []))
+            field_lines.append(f"- {field_name} (type: {spec['type']}, aliases: {aliases})")
+
+        fields_block = "\n".join(field_lines)
+
+        return f"""Tu dois extraire des informations financières précises depuis le contexte fourni.
+
+CHAMPS À EXTRAIRE:
+{fields_block}
+
+CONTEXTE:
+{context}
+
+INSTRUCTIONS:
+1. Cherche la valeur exacte de CHAQUE champ demandé dans le contexte
+2. Retourne UNIQUEMENT un tableau JSON avec une entrée par champ, dans l'ordre EXACT de la liste ci-dessus (ne répète pas les noms de champs):
+   [[<valeur>, <confiance 0.0-1.0>, "<extrait court du texte source>"], ...]
+3. Si une valeur n'est pas dans le contexte: [null, 0.0, null]
+4. Confiance = 1.0 si valeur explicite, 0.7-0.9 si déduite, 0.5-0.6 si ambiguë
+5. Pour les montants: ne retourne que le nombre (sans € ou espaces)
+6. Réponds UNIQUEMENT avec le JSON, rien d'autre
+
+RÉPONSE JSON:"""
+
+    def _extract_field(self, field_name: str, documents: List[Document],
+                       shared_context: str = None) -> dict:
         """
         Extrait un champ spécifique avec score de confiance
-        
+
         Args:
             field_name: Nom du champ à extraire
             documents: Documents sources
-            
+            shared_context: Contexte déjà récupéré à réutiliser (les prompts
+                partagent alors le même préfixe, que le serveur LLM peut
+                garder en cache KV d'un champ à l'autre)
+
         Returns:
             Dictionnaire avec valeur et confiance
         """
-        # Construire la requête de recherche
-        aliases = self.config.get_field_aliases(field_name)
-        search_query = f"{field_name} {' '.join(aliases)}"
-        
-        # Recherche RAG
-        relevant_docs = self.rag.retrieve(search_query, k=3)
-        
-        if not relevant_docs:
-            return {"value": None, "confidence": 0.0, "source": None}
-        
-        # Extraction via LLM
-        context = self._build_extraction_context(relevant_docs)
+        aliases = self._field_aliases[field_name]
+
+        if shared_context is not None:
+            context = shared_context
+        else:
+            # Recherche RAG ciblée sur le champ
+            relevant_docs = self.rag.retrieve(self._field_queries[field_name], k=3)
+
+            if not relevant_docs:
+                return {"value": None, "confidence": 0.0, "source": None}
+
+            context = self._build_extraction_context(relevant_docs)
+
+        field_type = self._field_types[field_name]
+        cache_key = self._cache_key(field_name, field_type, context)
+        cached = self._llm_cache.get(cache_key)
+        if cached is not None:
+            return dict(cached)
+
+        # Extraction via LLM (streaming, coupé dès que le JSON est complet)
         prompt = self._build_extraction_prompt(field_name, aliases, context)
-        
-        response = self.rag.llm.invoke(prompt)
-        
+
+        response = self._invoke_json(prompt)
+
         # Parser la réponse
-        return self._parse_extraction_response(response.content, field_name)
+        result = self._parse_extraction_response(response, field_name)
+        self._llm_cache[cache_key] = result
+        self._llm_cache_dirty = True
+        return result
     
     def _build_extraction_context(self, documents: List[Document]) -> str:
-        """Construit le contexte pour l'extraction"""
-        parts = []
-        for doc in documents:
-            parts.append(doc.page_content)
-        return "\n\n".join(parts)
+        """Construit le contexte pour l'extraction
+
+        Le résultat est mémoïsé par liste de documents: les appels de repli
+        qui reçoivent les mêmes chunks réutilisent la même chaîne (et donc
+        des prompts byte-identiques, voir _build_extraction_prompt) au lieu
+        d'en rematérialiser une à chaque champ. Chaque extrait est borné à
+        config.max_ctx_chars pour plafonner le coût de prefill LLM.
+        """
+        key = tuple(id(doc) for doc in documents)
+        cached = self._ctx_cache.get(key)
+        if cached is not None:
+            return cached
+
+        limit = getattr(self.config, 'max_ctx_chars', 4000)
+        context = "\n\n".join(doc.page_content[:limit] for doc in documents)
+
+        if len(self._ctx_cache) >= 64:
+            self._ctx_cache.pop(next(iter(self._ctx_cache)))
+        self._ctx_cache[key] = context
+        return context
     
     def _build_extraction_prompt(self, field_name: str, aliases: List[str], context: str) -> str:
-        """Construit le prompt d'extraction"""
-        field_type = self.config.extraction_schema[field_name]["type"]
-        
-        return f"""Tu dois extraire une information financière précise depuis le contexte fourni.
+        """Construit le prompt d'extraction d'un champ
 
-CHAMP À EXTRAIRE: {field_name}
-TYPE ATTENDU: {field_type}
-ALIASES POSSIBLES: {', '.join(aliases)}
+        Le contexte (la partie la plus longue) et les instructions viennent
+        en premier et sont identiques d'un champ à l'autre; seules les
+        dernières lignes varient. Les serveurs LLM qui font du cache de
+        préfixe ne re-calculent alors le prefill que sur la fin du prompt.
+        """
+        field_type = self._field_types[field_name]
+
+        return f"""Tu dois extraire une information financière précise depuis le contexte fourni.
 
 CONTEXTE:
 {context}
@@ -132,23 +403,78 @@ INSTRUCTIONS:
 5. Pour les montants: ne retourne que le nombre (sans € ou espaces)
 6. Réponds UNIQUEMENT avec le JSON, rien d'autre
 
+CHAMP À EXTRAIRE: {field_name}
+TYPE ATTENDU: {field_type}
+ALIASES POSSIBLES: {', '.join(aliases)}
+
 RÉPONSE JSON:"""
     
+    def _invoke_json(self, prompt: str) -> str:
+        """
+        Appelle le LLM en streaming et coupe dès que l'objet JSON se referme
+
+        Les modèles ajoutent parfois du texte après le JSON demandé; chaque
+        token décodé en trop coûte une itération de décodage complète. On
+        suit la profondeur des accolades (hors chaînes) et on ferme le flux
+        au retour à zéro, ce qui interrompt la génération côté serveur.
+
+        Args:
+            prompt: Prompt à envoyer
+
+        Returns:
+            Texte généré, tronqué juste après le JSON complet
+        """
+        try:
+            stream = self.rag.llm.stream(prompt)
+        except (AttributeError, NotImplementedError):
+            return self.rag.llm.invoke(prompt).content
+
+        parts = []
+        depth = 0
+        started = False
+        in_string = False
+        escaped = False
+
+        for chunk in stream:
+            text = chunk.content
+            if not text:
+                continue
+            parts.append(text)
+
+            for ch in text:
+                if escaped:
+                    escaped = False
+                elif ch == "\\" and in_string:
+                    escaped = True
+                elif ch == '"':
+                    in_string = not in_string
+                elif not in_string:
+                    if ch == "{" or ch == "[":
+                        depth += 1
+                        started = True
+                    elif ch == "}" or ch == "]":
+                        depth -= 1
+                        if started and depth <= 0:
+                            return "".join(parts)
+
+        return "".join(parts)
+
+    def _parse_json_response(self, response: str):
+        """Nettoie une réponse LLM (markdown éventuel) et parse le JSON"""
+        response = response.strip()
+        if response.startswith("```"):
+            response = _FENCE_RE.sub("", response)
+        return json_utils.loads(response)
+
     def _parse_extraction_response(self, response: str, field_name: str) -> dict:
         """Parse la réponse JSON du LLM"""
         try:
-            # Nettoyer la réponse (enlever markdown si présent)
-            response = response.strip()
-            if response.startswith("```"):
-                response = re.sub(r"```json\n?|\n?```", "", response)
-            
-            # Parser le JSON
-            data = json.loads(response)
-            
+            data = self._parse_json_response(response)
+
             # Valider et typer la valeur
             value = data.get("value")
             if value is not None:
-                field_type = self.config.extraction_schema[field_name]["type"]
+                field_type = self._field_types[field_name]
                 value = self._cast_value(value, field_type)
             
             return {
@@ -168,16 +494,16 @@ RÉPONSE JSON:"""
         
         try:
             if target_type == "float":
-                # Nettoyer les espaces et convertir
-                if isinstance(value, str):
-                    value = value.replace(" ", "").replace(",", ".")
-                return float(value)
-            
+                # Chemin rapide: déjà numérique, rien à nettoyer
+                if isinstance(value, (int, float)):
+                    return float(value)
+                return float(value.translate(_FLOAT_TRANS))
+
             elif target_type == "int":
-                if isinstance(value, str):
-                    value = value.replace(" ", "")
-                return int(float(value))
-            
+                if isinstance(value, (int, float)):
+                    return int(value)
+                return int(float(value.translate(_FLOAT_TRANS)))
+
             elif target_type == "str":
                 return str(value).strip()
             
@@ -200,17 +526,23 @@ RÉPONSE JSON:"""
         """
         # Rechercher des corrections similaires en mémoire
         similar_corrections = self.rag.memory.search_similar_extraction(documents)
-        
+
         if not similar_corrections:
             return extraction_result
-        
-        # Appliquer les corrections
-        data = extraction_result["data"].copy()
-        confidences = extraction_result["field_confidences"].copy()
-        
+
+        # Ne considérer que les corrections portant sur des champs extraits;
+        # sans intersection, rien à copier ni à recalculer
+        touched = {c["field"] for c in similar_corrections} & extraction_result["data"].keys()
+        if not touched:
+            return extraction_result
+
+        # Copies superficielles uniquement quand au moins un champ est visé
+        data = dict(extraction_result["data"])
+        confidences = dict(extraction_result["field_confidences"])
+
         for correction in similar_corrections:
             field = correction["field"]
-            if field in data:
+            if field in touched:
                 # Augmenter la confiance si la correction confirme
                 if data[field] == correction["corrected_value"]:
                     confidences[field] = min(1.0, confidences[field] + 0.2)
@@ -219,7 +551,7 @@ RÉPONSE JSON:"""
                     if correction.get("confidence", 0) > 0.8:
                         data[field] = correction["corrected_value"]
                         confidences[field] = correction["confidence"]
-        
+
         # Recalculer confiance globale
         global_confidence = sum(confidences.values()) / len(confidences) if confidences else 0
         
@@ -239,18 +571,37 @@ RÉPONSE JSON:"""
             Liste d'informations additionnelles avec raison d'ajout
         """
         additional_info = []
-        
-        # Vérifier les champs avec confiance moyenne (0.5-0.8)
-        for field, confidence in field_confidences.items():
-            if 0.5 <= confidence < 0.8:
-                additional_info.append({
-                    "field": field,
-                    "type": "medium_confidence",
-                    "value": extracted_data.get(field),
-                    "confidence": confidence,
-                    "reason": f"Valeur extraite avec confiance moyenne ({confidence:.2%}). Vérification recommandée.",
-                    "suggestion": "Vérifier manuellement cette valeur dans les documents sources."
-                })
+
+        # Les checks numériques (confiance moyenne, montants négatifs) sont
+        # évalués en une passe par le noyau _validation_masks; les dicts
+        # d'explication ne sont construits que pour les indices signalés
+        financial_fields = _SIGNED_FIN_FIELDS
+        conf_fields = list(field_confidences)
+        conf_values = np.fromiter(
+            field_confidences.values(), dtype=np.float64, count=len(conf_fields)
+        )
+        values = np.fromiter(
+            (
+                v if isinstance(v := extracted_data.get(f), (int, float)) else np.nan
+                for f in financial_fields
+            ),
+            dtype=np.float64,
+            count=len(financial_fields)
+        )
+        negative_mask, medium_mask = _validation_masks(values, conf_values)
+
+        # Champs avec confiance moyenne (0.5-0.8)
+        for i in np.flatnonzero(medium_mask):
+            field = conf_fields[i]
+            confidence = field_confidences[field]
+            additional_info.append({
+                "field": field,
+                "type": "medium_confidence",
+                "value": extracted_data.get(field),
+                "confidence": confidence,
+                "reason": f"Valeur extraite avec confiance moyenne ({confidence:.2%}). Vérification recommandée.",
+                "suggestion": "Vérifier manuellement cette valeur dans les documents sources."
+            })
         
         # Vérifier les valeurs déduites ou calculées
         if "finProfit" in extracted_data and "finOperationInc" in extracted_data and "finFinancialInc" in extracted_data:
@@ -279,19 +630,17 @@ RÉPONSE JSON:"""
                     "suggestion": "Vérifier que l'année est correcte dans les documents."
                 })
         
-        # Vérifier les montants négatifs
-        financial_fields = ["finSales", "finOperationInc", "finFinancialInc", "finProfit", "finBalanceSheet", "finEquity", "finAvailableFunds"]
-        for field in financial_fields:
-            if field in extracted_data:
-                value = extracted_data[field]
-                if isinstance(value, (int, float)) and value < 0:
-                    additional_info.append({
-                        "field": field,
-                        "type": "negative_value",
-                        "value": value,
-                        "reason": f"Valeur négative détectée pour {field}. Cela peut être normal (pertes, dettes) mais mérite vérification.",
-                        "suggestion": "Vérifier que la valeur négative est attendue selon le contexte financier."
-                    })
+        # Vérifier les montants négatifs (masque calculé plus haut;
+        # absents/non numériques = NaN, donc jamais signalés)
+        for i in np.flatnonzero(negative_mask):
+            field = financial_fields[i]
+            additional_info.append({
+                "field": field,
+                "type": "negative_value",
+                "value": extracted_data[field],
+                "reason": f"Valeur négative détectée pour {field}. Cela peut être normal (pertes, dettes) mais mérite vérification.",
+                "suggestion": "Vérifier que la valeur négative est attendue selon le contexte financier."
+            })
         
         return additional_info
     
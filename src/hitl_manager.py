@@ -4,15 +4,33 @@ Gestionnaire de validation humaine (Human-in-the-Loop)
 
 from typing import Dict, Optional
 import json
+import sys
 from src.config import Config
+from src.memory_manager import get_sheet
+
+# Champs dont l'absence déclenche toujours une validation humaine
+_CRITICAL_FIELDS = frozenset({"finSales", "finProfit", "finYear"})
 
 
 class HITLManager:
     """Gestion de la validation humaine et des corrections"""
     
+    # Coercitions par type de champ (lookup O(1) au lieu d'une chaîne de
+    # tests d'appartenance à des listes reconstruites à chaque appel)
+    _CONVERTERS = {
+        "integer": int,
+        "int": int,
+        "float": float,
+        "number": float,
+        "string": str,
+    }
+
     def __init__(self, config, memory_manager):
         self.config = config
         self.memory = memory_manager
+
+        # Infos de champ déjà résolues (le schéma est immuable par run)
+        self._field_info_cache: Dict[str, Optional[dict]] = {}
     
     def needs_validation(self, extraction_result: dict) -> bool:
         """
@@ -33,30 +51,25 @@ class HITLManager:
         missing = extraction_result.get("missing_fields", [])
         # Pour le nouveau format, on utilise confidence_score global uniquement
         # Les confidences par champ ne sont plus dans le format de sortie
-        
+
+        # Règles ordonnées du test le moins cher au plus cher, avec
+        # court-circuit dès qu'une règle tranche
+
         # Règle 1: Confiance globale trop faible
         if confidence < self.config.require_validation_below:
             return True
-        
+
         # Règle 2: Trop de champs manquants
         if len(missing) > self.config.missing_field_threshold:
             return True
-        
-        # Règle 3: Champs critiques manquants
-        critical_fields = ["finSales", "finProfit", "finYear"]
-        for field in critical_fields:
-            if field in missing:
-                return True
-        
-        # Règle 4: Auto-validation si confiance élevée
-        if confidence >= self.config.auto_validate_above:
-            return False
-        
-        # Règle 5: Entre les deux seuils -> validation par défaut
-        if self.config.require_validation_below <= confidence < self.config.auto_validate_above:
+
+        # Règle 3: Champs critiques manquants (intersection d'ensembles)
+        if _CRITICAL_FIELDS.intersection(missing):
             return True
-        
-        return False
+
+        # Règle 4: Auto-validation si confiance élevée, sinon validation
+        # par défaut (la règle 1 a déjà écarté le cas sous le seuil bas)
+        return confidence < self.config.auto_validate_above
     
     def request_validation(self, extraction_result: dict) -> dict:
         """
@@ -71,18 +84,34 @@ class HITLManager:
         Returns:
             Résultat validé avec corrections
         """
-        print("\n" + "="*60)
-        print("VALIDATION HUMAINE REQUISE")
-        print("="*60)
-        
-        data = extraction_result.get("sheet", {})
+        data = get_sheet(extraction_result)
         confidence = extraction_result.get("confidence_score", 0)
         missing = extraction_result.get("missing_fields", [])
-        
-        print(f"\nScore de confiance: {confidence:.4f} ({confidence:.2%})")
-        print(f"Champs extraits: {len(data)}")
-        print(f"[ATTENTION] Champs manquants: {len(missing)}")
-        
+
+        # Bannière émise en une seule écriture stdout (un syscall au lieu
+        # d'un par print)
+        sys.stdout.write("\n".join([
+            "",
+            "="*60,
+            "VALIDATION HUMAINE REQUISE",
+            "="*60,
+            "",
+            f"Score de confiance: {confidence:.4f} ({confidence:.2%})",
+            f"Champs extraits: {len(data)}",
+            f"[ATTENTION] Champs manquants: {len(missing)}",
+        ]) + "\n")
+        sys.stdout.flush()
+
+        # Mode batch: une seule session d'édition pour tout le dossier au
+        # lieu d'un input() bloquant par champ
+        if getattr(self.config, 'interactive_mode', 'batch') != "per_field":
+            corrections = self._batch_edit(data, missing, confidence)
+            if corrections is not None:
+                validated_result = self._apply_corrections(extraction_result, corrections)
+                print("\nValidation terminée")
+                return validated_result
+            print("[ATTENTION] Édition groupée indisponible, passage en mode champ par champ")
+
         # Afficher les données extraites
         print("\n" + "-"*60)
         print("DONNÉES EXTRAITES (SHEET):")
@@ -116,6 +145,97 @@ class HITLManager:
         print("\nValidation terminée")
         return validated_result
     
+    def _batch_edit(self, data: dict, missing: list, confidence: float) -> Optional[dict]:
+        """
+        Édition groupée du dossier dans $EDITOR
+
+        Écrit toutes les valeurs extraites et les champs manquants dans un
+        fichier JSON temporaire, ouvre l'éditeur une seule fois, puis
+        dérive les corrections du diff. N allers-retours input() deviennent
+        une session d'édition unique.
+
+        Args:
+            data: Valeurs extraites (sheet)
+            missing: Champs manquants
+            confidence: Confiance globale (affichée en en-tête du fichier)
+
+        Returns:
+            Dictionnaire de corrections au format _apply_corrections,
+            ou None si l'édition groupée n'est pas possible
+        """
+        import os
+        import subprocess
+        import tempfile
+
+        payload = {
+            "_instructions": (
+                f"Confiance globale: {confidence:.2%}. Modifiez les valeurs de 'sheet', "
+                "mettez une valeur à null pour la rejeter, remplissez 'missing' "
+                "pour ajouter un champ manquant, puis enregistrez et quittez."
+            ),
+            "sheet": data,
+            "missing": {field: None for field in missing}
+        }
+
+        # Initialisé avant le try: si la création du fichier temporaire
+        # échoue, le finally ne doit pas lever un NameError par-dessus
+        tmp_path = None
+
+        try:
+            with tempfile.NamedTemporaryFile(
+                mode='w', suffix=".json", delete=False, encoding='utf-8'
+            ) as f:
+                json.dump(payload, f, indent=2, ensure_ascii=False)
+                tmp_path = f.name
+
+            editor = os.environ.get("EDITOR", "vi")
+            if subprocess.call([editor, tmp_path]) != 0:
+                return None
+
+            with open(tmp_path, 'r', encoding='utf-8') as f:
+                edited = json.load(f)
+        except Exception as e:
+            print(f"[ATTENTION] Édition groupée impossible: {e}")
+            return None
+        finally:
+            if tmp_path is not None:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+
+        # Diff entre l'original et la version éditée
+        corrections = {}
+        edited_sheet = edited.get("sheet", {})
+
+        for field, value in data.items():
+            new_value = edited_sheet.get(field)
+            if new_value is None:
+                corrections[field] = {
+                    "action": "remove",
+                    "field": field,
+                    "reason": "Rejeté par l'utilisateur"
+                }
+            elif new_value != value:
+                corrections[field] = {
+                    "action": "correct",
+                    "field": field,
+                    "original_value": value,
+                    "new_value": new_value,
+                    "reason": "Corrigé par l'utilisateur"
+                }
+
+        for field, value in edited.get("missing", {}).items():
+            if value is not None:
+                corrections[field] = {
+                    "action": "add",
+                    "field": field,
+                    "value": value,
+                    "reason": "Ajouté manuellement par l'utilisateur"
+                }
+
+        return corrections
+
     def _ask_correction(self, field: str, current_value, confidence: float) -> Optional[dict]:
         """
         Demande une correction pour un champ de manière interactive
@@ -226,19 +346,25 @@ class HITLManager:
                 continue
     
     def _get_field_info(self, field: str) -> Optional[dict]:
-        """Récupère les informations sur un champ depuis la config"""
+        """Récupère les informations sur un champ depuis la config (mémoïsé)"""
+        if field in self._field_info_cache:
+            return self._field_info_cache[field]
+
+        info = None
         try:
             schema = self.config.extraction_schema
             if field in schema:
                 field_def = schema[field]
-                return {
+                info = {
                     "description": field_def.get("description", ""),
                     "aliases": field_def.get("aliases", []),
                     "type": field_def.get("type", "string")
                 }
         except:
             pass
-        return None
+
+        self._field_info_cache[field] = info
+        return info
     
     def _convert_field_value(self, field: str, value_str: str, field_info: Optional[dict]) -> any:
         """Convertit la valeur selon le type attendu du champ"""
@@ -253,67 +379,58 @@ class HITLManager:
                 return value_str
         
         field_type = field_info.get("type", "string")
-        
-        if field_type in ["integer", "int"]:
-            try:
-                return int(value_str)
-            except ValueError:
-                print(f"   ⚠️  Impossible de convertir en entier, gardé comme string")
-                return value_str
-        
-        elif field_type in ["float", "number"]:
-            try:
-                return float(value_str)
-            except ValueError:
-                print(f"   ⚠️  Impossible de convertir en nombre, gardé comme string")
-                return value_str
-        
-        elif field_type == "year" and field == "finYear":
+
+        # Cas particulier: année bornée
+        if field_type == "year" and field == "finYear":
             try:
                 year = int(value_str)
                 if 1900 <= year <= 2100:
                     return year
-                else:
-                    print(f"   ⚠️  Année invalide, gardé comme string")
-                    return value_str
+                print(f"   ⚠️  Année invalide, gardé comme string")
+                return value_str
             except ValueError:
                 return value_str
-        
-        else:
+
+        converter = self._CONVERTERS.get(field_type)
+        if converter is None:
+            return value_str
+
+        try:
+            return converter(value_str)
+        except ValueError:
+            print(f"   ⚠️  Impossible de convertir en {field_type}, gardé comme string")
             return value_str
     
     def _apply_corrections(self, original_result: dict, corrections: dict) -> dict:
         """Applique les corrections à l'extraction"""
-        validated = original_result.copy()
-        data = validated.get("sheet", {}).copy()
-        missing = list(validated.get("missing_fields", []))
-        original_confidence = validated.get("confidence_score", 0)
-        
+        data = dict(get_sheet(original_result))
+        missing = list(original_result.get("missing_fields", ()))
+
         # Appliquer chaque correction
         for field, correction in corrections.items():
             if correction["action"] == "correct":
                 data[field] = correction["new_value"]
-            
+
             elif correction["action"] == "add":
                 data[field] = correction["value"]
                 if field in missing:
                     missing.remove(field)
-            
+
             elif correction["action"] == "remove":
                 if field in data:
                     del data[field]
-        
-        # Après validation humaine, confiance = 1.0
-        validated.update({
+
+        # Résultat construit en une seule allocation; après validation
+        # humaine, confiance = 1.0
+        return {
+            **original_result,
             "sheet": data,
             "confidence_score": 1.0,  # Validation humaine = confiance maximale
             "missing_fields": missing if missing else [],
             "corrections": corrections,
             "validated_by_human": True,
-            "original_confidence": original_confidence
-        })
-        
-        return validated
+            "original_confidence": original_result.get("confidence_score", 0)
+        }
     
     def validate_qa_response(self, question: str, answer_result: dict) -> dict:
         """
@@ -326,32 +443,41 @@ class HITLManager:
         Returns:
             Résultat validé/corrigé
         """
-        import sys
-        
-        print("\n" + "="*60)
-        print("🔍 VALIDATION RÉPONSE Q&A")
-        print("="*60)
-        
-        print(f"\n❓ Question: {question}")
-        print(f"\n💬 Réponse actuelle: {answer_result['answer']}")
-        print(f"📊 Confiance: {answer_result['confidence']:.2%}")
-        
+        # Bannière construite puis émise en une seule écriture stdout
+        lines = [
+            "",
+            "="*60,
+            "🔍 VALIDATION RÉPONSE Q&A",
+            "="*60,
+            "",
+            f"❓ Question: {question}",
+            "",
+            f"💬 Réponse actuelle: {answer_result['answer']}",
+            f"📊 Confiance: {answer_result['confidence']:.2%}",
+        ]
+
         sources = answer_result.get('sources', [])
         if sources:
-            unique_sources = list(set(sources))
-            print(f"📚 Sources: {len(unique_sources)} document(s) unique(s)")
-            for i, source in enumerate(unique_sources[:3], 1):
-                print(f"   {i}. {source}")
-        
-        print("\n" + "-"*60)
-        print("💡 Options:")
-        print("   o / oui  → Accepter la réponse")
-        print("   n / non  → Rejeter et fournir la bonne réponse")
-        print("   c / corriger → Modifier la réponse")
-        print("   s / skip → Passer sans valider")
-        print("-"*60)
-        
+            # Dédoublonnage en une passe, ordre conservé; pas de seconde
+            # liste ni de re-slice pour l'affichage des trois premières
+            unique_sources = dict.fromkeys(sources)
+            lines.append(f"📚 Sources: {len(unique_sources)} document(s) unique(s)")
+            for i, source in zip(range(1, 4), unique_sources):
+                lines.append(f"   {i}. {source}")
+
+        lines += [
+            "",
+            "-"*60,
+            "💡 Options:",
+            "   o / oui  → Accepter la réponse",
+            "   n / non  → Rejeter et fournir la bonne réponse",
+            "   c / corriger → Modifier la réponse",
+            "   s / skip → Passer sans valider",
+            "-"*60,
+        ]
+
         # S'assurer que tout est affiché avant de demander l'input
+        sys.stdout.write("\n".join(lines) + "\n")
         sys.stdout.flush()
         sys.stderr.flush()
         
@@ -374,12 +500,6 @@ class HITLManager:
                 validated["validated_by_human"] = False
                 validated["corrected"] = False
                 return validated
-            except Exception as e:
-                print(f"\n❌ Erreur lors de la saisie: {e}")
-                print("⚠️  Veuillez réessayer")
-                import traceback
-                traceback.print_exc()
-                continue
             
             # Traiter la réponse
             if response in ['o', 'oui', 'y', 'yes', '']:
@@ -453,11 +573,11 @@ class HITLManager:
         """
         corrections = []
         
-        original_data = extraction_result.get("data", {})
-        validated_data = validated_result.get("data", {})
+        original_data = get_sheet(extraction_result)
+        validated_data = get_sheet(validated_result)
         
-        # Identifier les corrections
-        for field in set(list(original_data.keys()) + list(validated_data.keys())):
+        # Identifier les corrections (union directe des vues de clés)
+        for field in original_data.keys() | validated_data.keys():
             original_val = original_data.get(field)
             validated_val = validated_data.get(field)
             
@@ -0,0 +1,41 @@
+"""
+Sérialisation JSON accélérée (orjson quand disponible)
+"""
+
+import json
+
+try:
+    import orjson  # Implémentation native, 3-10× plus rapide que stdlib
+except ImportError:
+    orjson = None
+
+
+def loads(data):
+    """Désérialise du JSON (str ou bytes)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+
+def dumps(obj, indent: bool = True) -> str:
+    """Sérialise un objet en JSON UTF-8"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option).decode('utf-8')
+    return json.dumps(obj, indent=2 if indent else None, ensure_ascii=False)
+
+
+def load_file(path):
+    """Charge un fichier JSON"""
+    with open(path, 'rb') as f:
+        return loads(f.read())
+
+
+def dump_file(path, obj, indent: bool = True):
+    """Écrit un objet en JSON dans un fichier (une seule écriture binaire)"""
+    with open(path, 'wb') as f:
+        f.write(dumps(obj, indent=indent).encode('utf-8'))
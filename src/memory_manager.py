@@ -2,11 +2,43 @@
 Gestionnaire de mémoire persistante pour apprentissage
 """
 
-import json
+import atexit
+import os
+import queue
+import threading
+from collections import Counter
 from pathlib import Path
 from typing import Dict, List, Optional
 from datetime import datetime
 
+from src import json_utils
+
+# Index MinHash-LSH optionnel pour les grandes mémoires Q&A
+try:
+    from datasketch import MinHash, MinHashLSH
+except ImportError:
+    MinHash = None
+
+# En dessous de ce nombre d'enregistrements, l'index inverse par tokens
+# suffit largement; au-delà, le LSH borne le nombre de candidats à scorer
+_LSH_MIN_RECORDS = 1000
+_LSH_NUM_PERM = 64
+
+
+def get_sheet(result: dict) -> dict:
+    """Retourne les données extraites d'un résultat, clé "sheet" ou "data"
+
+    Le pipeline produit la clé "sheet" mais certains enregistrements
+    historiques utilisent "data": lire la mauvaise clé renvoyait un dict
+    vide en silence et remplissait la mémoire d'enregistrements sans
+    aucune correction.
+    """
+    sheet = result.get("sheet")
+    data = result.get("data")
+    if sheet is not None and data is not None and sheet != data:
+        print("⚠️  Clés 'sheet' et 'data' divergentes dans le résultat, 'sheet' retenue")
+    return sheet or data or {}
+
 
 class MemoryManager:
     """Gestion de la mémoire persistante des corrections"""
@@ -16,19 +48,109 @@ class MemoryManager:
         self.memory_dir.mkdir(exist_ok=True)
         
         # Fichiers de mémoire
-        self.corrections_file = self.memory_dir / "extraction_corrections.json"
-        self.qa_memory_file = self.memory_dir / "qa_corrections.json"
-        self.context_file = self.memory_dir / "manual_context.json"
-        
+        self.corrections_file = self.memory_dir / "extraction_corrections.jsonl"
+        self.qa_memory_file = self.memory_dir / "qa_corrections.jsonl"
+        self.context_file = self.memory_dir / "manual_context.jsonl"
+
+        # Cache en mémoire des fichiers JSON: chaque fichier n'est parsé
+        # qu'une fois par processus, les écritures passent en write-through
+        self._cache: Dict[Path, list] = {}
+
         # Initialiser si nécessaire
         self._init_memory_files()
+
+        # Index inverse token -> enregistrements Q&A: la recherche de
+        # question similaire ne score que les candidats partageant au
+        # moins un mot, au lieu de parcourir tout l'historique
+        self._qa_tokens: List[frozenset] = []
+        self._qa_index: Dict[str, set] = {}
+        self._lsh = None
+        for i, record in enumerate(self._load_json(self.qa_memory_file)):
+            self._index_qa_record(i, record)
+
+        # Au-delà d'un certain volume, un index MinHash-LSH remplace
+        # l'union de listes de candidats: requête approchée en temps
+        # sous-linéaire, vérifiée ensuite par le Jaccard exact
+        if MinHash is not None and len(self._qa_tokens) > _LSH_MIN_RECORDS:
+            self._lsh = MinHashLSH(threshold=0.7, num_perm=_LSH_NUM_PERM)
+            for i, tokens in enumerate(self._qa_tokens):
+                self._lsh.insert(i, self._minhash(tokens))
+
+        # Types de documents par correction, pré-convertis en frozenset:
+        # l'intersection dans search_similar_extraction ne reconstruit
+        # plus un set par enregistrement à chaque requête
+        self._corr_types: List[frozenset] = [
+            frozenset(record.get("document_types", []))
+            for record in self._load_json(self.corrections_file)
+        ]
+
+        # Écritures disque déléguées à un thread d'arrière-plan: le chemin
+        # critique de l'agent se réduit à un append en mémoire + put dans
+        # la file. Charge purement I/O, le GIL n'est pas un goulot ici
+        self._write_queue: queue.Queue = queue.Queue()
+        self._writer = threading.Thread(target=self._drain_writes, daemon=True)
+        self._writer.start()
+        # Vider la file avant la fin du processus pour ne rien perdre
+        atexit.register(self._write_queue.join)
+
+    def _drain_writes(self):
+        """Consomme la file d'écritures et ajoute chaque ligne au journal"""
+        while True:
+            file_path, record = self._write_queue.get()
+            try:
+                with open(file_path, 'a', encoding='utf-8') as f:
+                    f.write(json_utils.dumps(record, indent=False) + "\n")
+            except Exception as e:
+                print(f"⚠️  Écriture mémoire échouée ({file_path.name}): {e}")
+            finally:
+                self._write_queue.task_done()
+
+    @staticmethod
+    def _minhash(tokens: frozenset):
+        """Construit la signature MinHash d'un ensemble de tokens"""
+        mh = MinHash(num_perm=_LSH_NUM_PERM)
+        for token in tokens:
+            mh.update(token.encode('utf-8'))
+        return mh
+
+    def _index_qa_record(self, record_id: int, record: dict):
+        """Ajoute un enregistrement Q&A à l'index inverse par tokens"""
+        tokens = frozenset(record.get("question", "").lower().split())
+        self._qa_tokens.append(tokens)
+        for token in tokens:
+            self._qa_index.setdefault(token, set()).add(record_id)
+        if self._lsh is not None:
+            self._lsh.insert(record_id, self._minhash(tokens))
     
     def _init_memory_files(self):
-        """Initialise les fichiers de mémoire s'ils n'existent pas"""
+        """Initialise les fichiers de mémoire s'ils n'existent pas
+
+        Migre au passage les anciens fichiers JSON (un grand tableau) vers
+        le format JSON Lines: un enregistrement par ligne, ajout en O(1).
+        """
         for file in [self.corrections_file, self.qa_memory_file, self.context_file]:
-            if not file.exists():
-                with open(file, 'w', encoding='utf-8') as f:
-                    json.dump([], f)
+            if file.exists():
+                continue
+
+            legacy = file.with_suffix('.json')
+            if legacy.exists():
+                try:
+                    # Écriture dans un fichier temporaire puis renommage
+                    # atomique: un crash en pleine migration ne laisse
+                    # jamais un journal tronqué en place
+                    records = json_utils.load_file(legacy)
+                    tmp = file.with_suffix(file.suffix + '.tmp')
+                    with open(tmp, 'w', encoding='utf-8') as f:
+                        for record in records:
+                            f.write(json_utils.dumps(record, indent=False) + "\n")
+                    os.replace(tmp, file)
+                    legacy.unlink()
+                    print(f"💾 Mémoire migrée vers {file.name}")
+                    continue
+                except Exception as e:
+                    print(f"⚠️  Migration de {legacy.name} impossible: {e}")
+
+            file.touch()
     
     def store_corrections(
         self, 
@@ -44,34 +166,31 @@ class MemoryManager:
             original_result: Extraction originale
             validated_result: Résultat validé
         """
-        # Charger la mémoire existante
-        corrections = self._load_json(self.corrections_file)
-        
         # Créer l'enregistrement
         record = {
             "timestamp": datetime.now().isoformat(),
             "document_sources": [d.metadata.get("source") for d in documents],
             "document_types": list(set(d.metadata.get("doc_type") for d in documents)),
             "original": {
-                "data": original_result.get("data", {}),
+                "data": get_sheet(original_result),
                 "confidence": original_result.get("global_confidence", 0),
                 "missing_fields": original_result.get("missing_fields", [])
             },
             "validated": {
-                "data": validated_result.get("data", {}),
+                "data": get_sheet(validated_result),
                 "confidence": validated_result.get("global_confidence", 0),
                 "missing_fields": validated_result.get("missing_fields", [])
             },
             "corrections": self._identify_corrections(
-                original_result.get("data", {}),
-                validated_result.get("data", {})
+                get_sheet(original_result),
+                get_sheet(validated_result)
             )
         }
         
-        # Ajouter et sauvegarder
-        corrections.append(record)
-        self._save_json(self.corrections_file, corrections)
-        
+        # Ajouter en fin de journal (O(1), pas de réécriture du fichier)
+        self._append_record(self.corrections_file, record)
+        self._corr_types.append(frozenset(record["document_types"]))
+
         print(f"💾 {len(record['corrections'])} corrections enregistrées")
     
     def store_qa_correction(
@@ -88,8 +207,6 @@ class MemoryManager:
             original_answer: Réponse originale
             corrected_answer: Réponse corrigée
         """
-        qa_memory = self._load_json(self.qa_memory_file)
-        
         record = {
             "timestamp": datetime.now().isoformat(),
             "question": question,
@@ -100,9 +217,9 @@ class MemoryManager:
             "sources": corrected_answer.get("sources", [])
         }
         
-        qa_memory.append(record)
-        self._save_json(self.qa_memory_file, qa_memory)
-        
+        self._append_record(self.qa_memory_file, record)
+        self._index_qa_record(len(self._qa_tokens), record)
+
         print("💾 Correction Q&A enregistrée")
     
     def store_manual_context(self, context_data: dict):
@@ -112,16 +229,13 @@ class MemoryManager:
         Args:
             context_data: Données contextuelles
         """
-        contexts = self._load_json(self.context_file)
-        
         record = {
             "timestamp": datetime.now().isoformat(),
             **context_data
         }
-        
-        contexts.append(record)
-        self._save_json(self.context_file, contexts)
-        
+
+        self._append_record(self.context_file, record)
+
         print("💾 Contexte manuel enregistré")
     
     def search_similar_extraction(self, current_documents: list) -> List[dict]:
@@ -139,11 +253,10 @@ class MemoryManager:
         # Extraire types de documents actuels
         current_types = set(d.metadata.get("doc_type") for d in current_documents)
         
-        # Filtrer les corrections avec contexte similaire
+        # Filtrer les corrections avec contexte similaire (les frozensets
+        # de types sont pré-construits dans _corr_types)
         similar = []
-        for record in corrections:
-            record_types = set(record.get("document_types", []))
-            
+        for record, record_types in zip(corrections, self._corr_types):
             # Si intersection de types de documents
             if current_types & record_types:
                 # Extraire les corrections individuelles
@@ -168,15 +281,28 @@ class MemoryManager:
             Réponse mémorisée si trouvée
         """
         qa_memory = self._load_json(self.qa_memory_file)
-        
-        question_lower = question.lower()
-        
-        # Recherche par similarité simple (mots-clés)
-        for record in reversed(qa_memory):  # Plus récent d'abord
-            stored_question = record.get("question", "").lower()
-            
-            # Similarité basique: mots communs
-            if self._calculate_similarity(question_lower, stored_question) > 0.7:
+
+        query_tokens = set(question.lower().split())
+        if not query_tokens:
+            return None
+
+        # Candidats: via l'index LSH (grandes mémoires, temps sous-linéaire)
+        # ou l'index inverse par tokens (union de listes)
+        if self._lsh is not None:
+            candidates = set(self._lsh.query(self._minhash(frozenset(query_tokens))))
+        else:
+            candidates = set()
+            for token in query_tokens:
+                candidates.update(self._qa_index.get(token, ()))
+
+        # Similarité de Jaccard sur les seuls candidats. Le journal étant
+        # append-only, l'indice d'enregistrement croît avec le temps: trier
+        # les ids en décroissant donne l'ordre MRU (plus récent d'abord)
+        # sans jamais parcourir l'historique complet à rebours
+        for record_id in sorted(candidates, reverse=True):
+            tokens = self._qa_tokens[record_id]
+            if len(query_tokens & tokens) / len(query_tokens | tokens) > 0.7:
+                record = qa_memory[record_id]
                 return {
                     "question": question,
                     "answer": record["corrected_answer"],
@@ -184,7 +310,7 @@ class MemoryManager:
                     "sources": record.get("sources", []),
                     "from_memory": True
                 }
-        
+
         return None
     
     def get_correction_stats(self) -> dict:
@@ -207,7 +333,8 @@ class MemoryManager:
         """Identifie les différences entre original et validé"""
         corrections = []
         
-        all_fields = set(list(original.keys()) + list(validated.keys()))
+        # Union directe des vues de clés, sans listes intermédiaires
+        all_fields = original.keys() | validated.keys()
         
         for field in all_fields:
             orig_val = original.get(field)
@@ -247,46 +374,85 @@ class MemoryManager:
     
     def _get_most_corrected_fields(self, corrections: List[dict]) -> dict:
         """Identifie les champs les plus souvent corrigés"""
-        field_counts = {}
-        
+        counts = Counter()
         for record in corrections:
-            for correction in record.get("corrections", []):
-                field = correction["field"]
-                field_counts[field] = field_counts.get(field, 0) + 1
-        
-        # Trier par fréquence
-        sorted_fields = sorted(
-            field_counts.items(), 
-            key=lambda x: x[1], 
-            reverse=True
-        )
-        
-        return dict(sorted_fields[:5])  # Top 5
+            counts.update(
+                correction["field"] for correction in record.get("corrections", [])
+            )
+
+        # Top 5 par fréquence (sélection par tas, pas de tri complet)
+        return dict(counts.most_common(5))
     
     def _load_json(self, file_path: Path) -> list:
-        """Charge un fichier JSON"""
-        try:
+        """Charge un journal JSONL (depuis le cache après la première lecture)
+
+        Une ligne illisible (écriture interrompue) est ignorée avec un
+        avertissement au lieu de jeter tout l'historique.
+        """
+        cached = self._cache.get(file_path)
+        if cached is not None:
+            return cached
+
+        data = []
+        if file_path.exists():
             with open(file_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception:
-            return []
-    
-    def _save_json(self, file_path: Path, data: list):
-        """Sauvegarde en JSON"""
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+                for line_no, line in enumerate(f, 1):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        data.append(json_utils.loads(line))
+                    except Exception:
+                        print(f"⚠️  Ligne {line_no} illisible dans {file_path.name}, ignorée")
+
+        self._cache[file_path] = data
+        return data
+
+    def _append_record(self, file_path: Path, record: dict):
+        """Ajoute un enregistrement au journal (cache + écriture asynchrone)"""
+        self._load_json(file_path).append(record)
+        self._write_queue.put((file_path, record))
     
     def export_memory(self, output_path: str):
-        """Exporte toute la mémoire dans un fichier unique"""
-        export = {
-            "timestamp": datetime.now().isoformat(),
-            "extraction_corrections": self._load_json(self.corrections_file),
-            "qa_corrections": self._load_json(self.qa_memory_file),
-            "manual_context": self._load_json(self.context_file),
-            "stats": self.get_correction_stats()
-        }
-        
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(export, f, indent=2, ensure_ascii=False)
-        
+        """Exporte toute la mémoire dans un fichier unique
+
+        Export en streaming: les lignes des journaux JSONL sont recopiées
+        une à une dans le JSON de sortie au lieu de matérialiser les trois
+        historiques en mémoire — le pic mémoire reste celui d'un seul
+        enregistrement quelle que soit la taille de l'historique.
+        """
+        # S'assurer que les écritures en attente sont sur disque
+        self._write_queue.join()
+
+        sections = [
+            ("extraction_corrections", self.corrections_file),
+            ("qa_corrections", self.qa_memory_file),
+            ("manual_context", self.context_file),
+        ]
+
+        with open(output_path, 'w', encoding='utf-8') as out:
+            out.write('{\n')
+            out.write(f'  "timestamp": {json_utils.dumps(datetime.now().isoformat(), indent=False)},\n')
+
+            for name, path in sections:
+                out.write(f'  "{name}": [\n')
+                first = True
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        for line in f:
+                            line = line.strip()
+                            if not line:
+                                continue
+                            if not first:
+                                out.write(',\n')
+                            out.write('    ' + line)
+                            first = False
+                except Exception:
+                    pass
+                out.write('\n  ],\n')
+
+            out.write('  "stats": ')
+            out.write(json_utils.dumps(self.get_correction_stats(), indent=False))
+            out.write('\n}\n')
+
         print(f"✅ Mémoire exportée vers {output_path}")
@@ -2,16 +2,181 @@
 Moteur de réponse aux questions qualitatives
 """
 
+import asyncio
 import re
-from typing import Dict, List
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from src import json_utils
+
+# Ouvertures conversationnelles qui ne nécessitent aucune recherche
+# documentaire: inutile de payer embed + FAISS + long contexte pour
+# "bonjour" ou "merci"
+_SMALLTALK_RE = re.compile(
+    r"^(bonjour|bonsoir|salut|hello|hi|merci|ok|d'accord|au revoir"
+    r"|ça va|comment vas[- ]tu|qui es[- ]tu|quel est ton rôle)\b",
+    re.IGNORECASE
+)
+
+# Marqueurs d'incertitude fusionnés en une seule alternation compilée:
+# un seul parcours de la réponse au lieu de sept re.search successifs
+_UNCERTAINTY_RE = re.compile(
+    r"je ne suis pas sûr"
+    r"|il semble que"
+    r"|peut-être"
+    r"|probablement"
+    r"|information non disponible"
+    r"|pas d'information"
+    r"|ne trouve pas"
+)
+
+
+class SemanticCache:
+    """Cache sémantique de réponses Q&A
+
+    Les questions déjà répondues sont indexées par leur embedding
+    normalisé dans un petit IndexFlatIP; une nouvelle question assez
+    proche (cosinus >= seuil) est servie depuis le cache sans repayer
+    la recherche ni l'appel LLM. Les entrées expirent après un TTL et
+    le cache est borné (éviction des plus anciennes).
+    """
+
+    _MAX_ENTRIES = 5000
+    _TTL_SECONDS = 24 * 3600
+    _SAVE_EVERY = 32  # Insertions entre deux écritures disque
+
+    def __init__(self, cache_dir: Path, threshold: float, model: str):
+        import atexit
+        import faiss
+
+        self.threshold = threshold
+        # Le modèle d'embedding fait partie du nom de fichier (comme le
+        # cache d'embeddings): changer de modèle — et donc de dimension —
+        # repart d'un cache vide au lieu de planter la recherche faiss
+        self._index_file = Path(cache_dir) / f"sem_cache_{model}.faiss"
+        self._meta_file = Path(cache_dir) / f"sem_cache_{model}.json"
+        self._index = None
+        self._results: List[dict] = []
+        self._times: List[float] = []
+
+        # Écriture différée: marquer sale à l'insertion, persister par
+        # paquets et à la fin du processus plutôt que réécrire tout le
+        # cache à chaque réponse
+        self._dirty = False
+        self._adds_since_save = 0
+        atexit.register(self._save)
+
+        # Recharger le cache persisté d'une session précédente
+        try:
+            if self._index_file.exists() and self._meta_file.exists():
+                index = faiss.read_index(str(self._index_file))
+                meta = json_utils.load_file(self._meta_file)
+                results = meta["results"]
+                times = meta["times"]
+                # Un crash entre l'écriture de l'index et celle des
+                # métadonnées laisse les deux fichiers désalignés:
+                # repartir de zéro plutôt qu'exposer lookup à un
+                # IndexError sur self._results[i]
+                if index.ntotal == len(results) == len(times):
+                    self._index = index
+                    self._results = results
+                    self._times = times
+                else:
+                    print("⚠️  Cache sémantique désaligné, réinitialisé")
+        except Exception as e:
+            print(f"⚠️  Cache sémantique non rechargé: {e}")
+            self._index = None
+            self._results, self._times = [], []
+
+    @staticmethod
+    def _normalize(vector):
+        import numpy as np
+
+        xq = np.asarray(vector, dtype="float32").reshape(1, -1)
+        norm = np.linalg.norm(xq)
+        return xq / norm if norm else xq
+
+    def lookup(self, vector) -> Optional[dict]:
+        """Retourne la réponse en cache la plus proche si assez similaire"""
+        if self._index is None or not self._results:
+            return None
+
+        scores, ids = self._index.search(self._normalize(vector), 1)
+        i = int(ids[0][0])
+        if i < 0 or scores[0][0] < self.threshold:
+            return None
+        if time.time() - self._times[i] > self._TTL_SECONDS:
+            return None
+        return self._results[i]
+
+    def add(self, vector, result: dict):
+        """Mémorise une réponse sous l'embedding de sa question"""
+        import faiss
+
+        xq = self._normalize(vector)
+        if self._index is None:
+            self._index = faiss.IndexFlatIP(xq.shape[1])
+
+        self._index.add(xq)
+        self._results.append(result)
+        self._times.append(time.time())
+
+        # Borne: ne garder que la moitié la plus récente (les vecteurs
+        # sont relus depuis l'index Flat, qui les stocke en clair)
+        if len(self._results) > self._MAX_ENTRIES:
+            keep = self._MAX_ENTRIES // 2
+            vectors = self._index.reconstruct_n(len(self._results) - keep, keep)
+            self._index = faiss.IndexFlatIP(xq.shape[1])
+            self._index.add(vectors)
+            self._results = self._results[-keep:]
+            self._times = self._times[-keep:]
+
+        self._dirty = True
+        self._adds_since_save += 1
+        if self._adds_since_save >= self._SAVE_EVERY:
+            self._save()
+
+    def _save(self):
+        if not self._dirty:
+            return
+
+        import faiss
+
+        try:
+            if self._index is not None:
+                faiss.write_index(self._index, str(self._index_file))
+            json_utils.dump_file(
+                self._meta_file,
+                {"results": self._results, "times": self._times},
+                indent=False
+            )
+            self._dirty = False
+            self._adds_since_save = 0
+        except Exception as e:
+            print(f"⚠️  Cache sémantique non sauvegardé: {e}")
 
 
 class QAEngine:
     """Gestion des questions-réponses sur l'entreprise"""
-    
+
     def __init__(self, config, rag_engine):
         self.config = config
         self.rag = rag_engine
+
+        # Suggestions mémoïsées par liste de documents (le résultat ne
+        # dépend que de l'ensemble des doc_type présents)
+        self._suggest_cache: Dict[tuple, List[str]] = {}
+
+        # Cache sémantique des réponses (optionnel, nécessite faiss)
+        try:
+            self._sem_cache = SemanticCache(
+                Path(config.rag_index_path),
+                getattr(config, 'semantic_cache_threshold', 0.95),
+                config.embedding_model
+            )
+        except ImportError:
+            self._sem_cache = None
     
     def answer(self, question: str) -> dict:
         """
@@ -23,8 +188,44 @@ class QAEngine:
         Returns:
             Dictionnaire avec réponse, confiance, sources
         """
-        # Récupérer le contexte pertinent
-        relevant_docs = self.rag.retrieve(question, k=5)
+        # Routeur: les questions conversationnelles court-circuitent
+        # entièrement le pipeline RAG (pas d'embedding, pas de recherche,
+        # pas de long contexte dans le prompt)
+        if not self._needs_rag(question):
+            response = self.rag.llm.invoke(
+                "Tu es un assistant d'analyse financière. Réponds brièvement "
+                f"et poliment.\n\n{question}"
+            )
+            return {
+                "question": question,
+                "answer": response.content,
+                "confidence": 0.5,
+                "sources": [],
+                "skipped_rag": True,
+                "needs_validation": False
+            }
+
+        # Cache sémantique: une question quasi identique déjà traitée
+        # évite la recherche et l'appel LLM (l'embedding est réutilisé
+        # ensuite par retrieve via le cache d'embeddings)
+        query_vector = None
+        if self._sem_cache is not None:
+            try:
+                query_vector = self.rag.embeddings.embed_query(question)
+            except Exception:
+                query_vector = None
+            if query_vector is not None:
+                cached = self._sem_cache.lookup(query_vector)
+                if cached is not None:
+                    return {**cached, "question": question, "from_cache": True}
+
+        # Récupérer le contexte pertinent en réutilisant l'embedding déjà
+        # calculé pour le cache sémantique (une seule RPC d'embedding par
+        # question au lieu de deux)
+        if query_vector is not None:
+            relevant_docs = self.rag.retrieve_by_vector(query_vector, k=5)
+        else:
+            relevant_docs = self.rag.retrieve(question, k=5)
         
         if not relevant_docs:
             return {
@@ -45,7 +246,7 @@ class QAEngine:
             relevant_docs
         )
         
-        return {
+        answer_result = {
             "question": question,
             "answer": result["response"],
             "confidence": confidence,
@@ -53,7 +254,77 @@ class QAEngine:
             "context_chunks": result["context_used"],
             "needs_validation": confidence < self.config.confidence_threshold
         }
+
+        if self._sem_cache is not None and query_vector is not None:
+            self._sem_cache.add(query_vector, answer_result)
+
+        return answer_result
     
+    def answer_stream(self, question: str):
+        """
+        Version streaming de answer()
+
+        Yield les fragments de texte de la réponse au fur et à mesure,
+        puis, en dernier élément, le dictionnaire résultat complet au
+        même format que answer() (confiance évaluée sur le texte final).
+
+        Args:
+            question: Question en langage naturel
+
+        Yields:
+            Fragments de texte (str), puis le résultat final (dict)
+        """
+        relevant_docs = self.rag.retrieve(question, k=5)
+
+        if not relevant_docs:
+            answer = ("Je ne trouve pas d'information dans les documents "
+                      "fournis pour répondre à cette question.")
+            yield answer
+            yield {
+                "question": question,
+                "answer": answer,
+                "confidence": 0.0,
+                "sources": [],
+                "needs_validation": True
+            }
+            return
+
+        parts = []
+        for fragment in self.rag.generate_with_context_stream(question, relevant_docs):
+            parts.append(fragment)
+            yield fragment
+
+        answer = "".join(parts)
+        confidence = self._assess_confidence(question, answer, relevant_docs)
+
+        yield {
+            "question": question,
+            "answer": answer,
+            "confidence": confidence,
+            "sources": [doc.metadata.get("source") for doc in relevant_docs],
+            "context_chunks": len(relevant_docs),
+            "needs_validation": confidence < self.config.confidence_threshold
+        }
+
+    def _needs_rag(self, question: str) -> bool:
+        """
+        Détermine si une question justifie le pipeline RAG complet
+
+        Heuristique volontairement conservatrice: seules les ouvertures
+        conversationnelles évidentes (salutations, remerciements) sans
+        terme du schéma financier sont routées directement vers le LLM.
+        """
+        stripped = question.strip()
+
+        if not _SMALLTALK_RE.match(stripped):
+            return True
+
+        # Un terme financier dans la phrase force le passage par le RAG
+        if self.config.find_field_matches(stripped):
+            return True
+
+        return len(stripped) >= 60
+
     def _assess_confidence(self, question: str, answer: str, context_docs: List) -> float:
         """
         Évalue la confiance dans la réponse
@@ -64,26 +335,20 @@ class QAEngine:
         - Longueur et spécificité de la réponse
         """
         confidence = 0.5  # Baseline
-        
+
         # Indicateurs d'incertitude (pénalité)
-        uncertainty_patterns = [
-            r"je ne suis pas sûr",
-            r"il semble que",
-            r"peut-être",
-            r"probablement",
-            r"information non disponible",
-            r"pas d'information",
-            r"ne trouve pas"
-        ]
-        
         answer_lower = answer.lower()
-        for pattern in uncertainty_patterns:
-            if re.search(pattern, answer_lower):
-                confidence -= 0.2
-                break
+        if _UNCERTAINTY_RE.search(answer_lower):
+            confidence -= 0.2
         
-        # Réponse substantielle (bonus)
-        if len(answer) > 100 and not any(p in answer_lower for p in ["non disponible", "ne trouve pas"]):
+        # Réponse substantielle (bonus): test de longueur d'abord (le
+        # moins cher), puis deux recherches de sous-chaîne directes au
+        # lieu d'un générateur sur une liste reconstruite à chaque appel
+        if (
+            len(answer) > 100
+            and "non disponible" not in answer_lower
+            and "ne trouve pas" not in answer_lower
+        ):
             confidence += 0.3
         
         # Qualité du contexte (bonus)
@@ -94,8 +359,112 @@ class QAEngine:
         return max(0.0, min(1.0, round(confidence, 2)))
     
     def batch_answer(self, questions: List[str]) -> List[dict]:
-        """Répond à plusieurs questions en batch"""
-        return [self.answer(q) for q in questions]
+        """Répond à plusieurs questions en batch
+
+        Les embeddings partent en un seul appel et les générations LLM
+        se recouvrent (asyncio); repli séquentiel si l'async échoue.
+        """
+        try:
+            return asyncio.run(self.abatch_answer(questions))
+        except Exception as e:
+            print(f"⚠️  Batch asynchrone indisponible ({e}), traitement séquentiel")
+            return [self.answer(q) for q in questions]
+
+    async def abatch_answer(self, questions: List[str]) -> List[dict]:
+        """
+        Répond à plusieurs questions en recouvrant les latences réseau
+
+        Trois étapes au lieu de N appels séquentiels:
+        1. un seul appel d'embedding pour toutes les questions;
+        2. recherches FAISS locales sur les vecteurs précalculés;
+        3. générations LLM lancées en parallèle (asyncio.gather).
+
+        Args:
+            questions: Questions en langage naturel
+
+        Returns:
+            Liste de résultats au même format que answer()
+        """
+        if not questions:
+            return []
+
+        # 1. Embeddings en un seul batch
+        vectors = await self.rag.embeddings.aembed_documents(questions)
+
+        # 2. Recherches vectorielles (locales, pas de réseau)
+        k = self.config.top_k_retrieval
+        docs_per_question = []
+        for vector in vectors:
+            if self.rag.vectorstore is None:
+                docs_per_question.append([])
+                continue
+            scored = self.rag.vectorstore.similarity_search_with_score_by_vector(vector, k=k)
+            # Même filtre de score que retrieve(): cosinus (plus grand =
+            # plus proche) sur un index produit scalaire, distance L2 sinon
+            if self.rag._normalized_ip:
+                docs_per_question.append([
+                    doc for doc, score in scored
+                    if score > getattr(self.config, 'similarity_threshold', 0.6)
+                ])
+            else:
+                docs_per_question.append([doc for doc, score in scored if score < 1.5])
+
+        # 3. Générations LLM en parallèle pour les questions avec contexte
+        pending = [i for i, docs in enumerate(docs_per_question) if docs]
+        prompts = [
+            self.rag._build_prompt(
+                questions[i],
+                self.rag._build_context(docs_per_question[i])
+            )
+            for i in pending
+        ]
+        # Regrouper les prompts par classe de longueur (multi-bin
+        # batching): un prompt très long ne retarde plus tout un lot de
+        # prompts courts, chaque classe part comme son propre batch
+        from bisect import bisect_left
+
+        bin_edges = (256, 512, 1024, 2048)
+        bins: Dict[int, List[int]] = {}
+        for j, prompt in enumerate(prompts):
+            b = bisect_left(bin_edges, self.rag._count_tokens(prompt))
+            bins.setdefault(b, []).append(j)
+
+        responses: List = [None] * len(prompts)
+        batches = await asyncio.gather(
+            *[
+                self.rag.llm.abatch([prompts[j] for j in positions])
+                for positions in bins.values()
+            ]
+        )
+        for positions, batch in zip(bins.values(), batches):
+            for j, response in zip(positions, batch):
+                responses[j] = response
+
+        # Assembler les résultats dans l'ordre des questions
+        results: List[Optional[dict]] = [None] * len(questions)
+        for i, response in zip(pending, responses):
+            docs = docs_per_question[i]
+            confidence = self._assess_confidence(questions[i], response.content, docs)
+            results[i] = {
+                "question": questions[i],
+                "answer": response.content,
+                "confidence": confidence,
+                "sources": [doc.metadata.get("source") for doc in docs],
+                "context_chunks": len(docs),
+                "needs_validation": confidence < self.config.confidence_threshold
+            }
+
+        for i, result in enumerate(results):
+            if result is None:
+                results[i] = {
+                    "question": questions[i],
+                    "answer": "Je ne trouve pas d'information dans les documents fournis pour répondre à cette question.",
+                    "confidence": 0.0,
+                    "sources": [],
+                    "needs_validation": True
+                }
+
+        return results
     
     def answer_with_memory(self, question: str) -> dict:
         """
@@ -154,10 +523,16 @@ class QAEngine:
         
         Utile pour guider l'utilisateur
         """
-        # Analyser les types de documents disponibles
-        doc_types = set()
-        for doc in documents:
-            doc_types.add(doc.metadata.get("doc_type", "unknown"))
+        # Analyser les types de documents disponibles (une seule passe)
+        doc_types = {doc.metadata.get("doc_type", "unknown") for doc in documents}
+
+        # Sortie mémoïsée par contenu: les suggestions ne dépendent que
+        # de l'ensemble des types présents, la clé est donc insensible à
+        # l'identité de la liste (rerun Streamlit, liste reconstruite...)
+        cache_key = (frozenset(doc_types), len(documents))
+        cached = self._suggest_cache.get(cache_key)
+        if cached is not None:
+            return cached
         
         suggestions = []
         
@@ -176,4 +551,10 @@ class QAEngine:
                 "Quel est le montant des capitaux propres ?",
             ])
         
-        return suggestions[:5]  # Limiter à 5 suggestions
+        suggestions = suggestions[:5]  # Limiter à 5 suggestions
+
+        if len(self._suggest_cache) > 16:
+            self._suggest_cache.clear()
+        self._suggest_cache[cache_key] = suggestions
+
+        return suggestions
@@ -4,9 +4,11 @@ Moteur RAG: indexation et recherche vectorielle
 
 from typing import List, Dict, Optional
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_community.vectorstores import FAISS
 import json
 import os
+import pickle
 from pathlib import Path
 
 try:
@@ -16,6 +18,128 @@ except ImportError:
 
 from src.config import Config
 
+# Préambule invariant des prompts Q&A. Il doit rester identique à l'octet
+# près d'un appel à l'autre: placé en tête (la partie variable vient
+# après), il est servi par le cache de préfixe côté serveur OpenAI au
+# lieu d'être re-préfillé à chaque appel.
+_SYSTEM_PROMPT = """Tu es un assistant d'analyse financière. Réponds à la question en te basant UNIQUEMENT sur le contexte fourni.
+
+INSTRUCTIONS:
+- Réponds de manière précise et factuelle
+- Cite les sources quand c'est pertinent
+- Si l'information n'est pas dans le contexte, dis "Information non disponible dans les documents"
+- Ne fais AUCUNE supposition ou hallucination"""
+
+
+def _shared_http_client():
+    """Client HTTP partagé pour tous les appels OpenAI du processus
+
+    Une seule connexion persistante (HTTP/2 si h2 est installé) évite de
+    repayer l'établissement TCP+TLS à chaque appel; les requêtes
+    parallélisées de l'extraction sont multiplexées dessus.
+    """
+    import httpx
+
+    limits = httpx.Limits(max_keepalive_connections=32)
+    try:
+        return httpx.Client(http2=True, limits=limits)
+    except ImportError:
+        # Paquet h2 absent: HTTP/1.1 avec keep-alive reste partagé
+        return httpx.Client(limits=limits)
+
+
+_HTTP_CLIENT = None
+
+
+class CachedEmbeddings(Embeddings):
+    """Cache d'embeddings à deux niveaux devant OpenAIEmbeddings
+
+    Hérite d'Embeddings: le vectorstore LangChain dispatche sur
+    isinstance(embedding_function, Embeddings) et appellerait sinon
+    l'objet comme une fonction.
+
+    Chaque texte est haché (SHA-1) et son vecteur mémorisé dans un LRU en
+    mémoire puis dans un shelve sur disque: une requête déjà vue ne
+    repaie ni la tokenisation ni l'aller-retour réseau. Le nom du modèle
+    fait partie du fichier de cache, changer de modèle d'embedding
+    repart donc d'un cache vide.
+    """
+
+    _LRU_MAX = 10_000
+
+    def __init__(self, inner, cache_dir: Path, model: str):
+        import shelve
+        from collections import OrderedDict
+
+        self._inner = inner
+        self._lru: "OrderedDict[str, list]" = OrderedDict()
+
+        cache_dir.mkdir(exist_ok=True, parents=True)
+        try:
+            self._disk = shelve.open(str(cache_dir / f"emb_cache_{model}"))
+        except Exception as e:
+            print(f"⚠️  Cache d'embeddings disque indisponible: {e}")
+            self._disk = None
+
+    def __getattr__(self, name):
+        # Tout le reste (aembed_*, attributs de config...) passe au modèle
+        return getattr(self._inner, name)
+
+    @staticmethod
+    def _key(text: str) -> str:
+        import hashlib
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def _get(self, key: str):
+        vector = self._lru.get(key)
+        if vector is not None:
+            self._lru.move_to_end(key)
+            return vector
+        if self._disk is not None:
+            try:
+                vector = self._disk.get(key)
+            except Exception:
+                vector = None
+            if vector is not None:
+                self._put_lru(key, vector)
+        return vector
+
+    def _put(self, key: str, vector: list):
+        self._put_lru(key, vector)
+        if self._disk is not None:
+            try:
+                self._disk[key] = vector
+            except Exception:
+                pass
+
+    def _put_lru(self, key: str, vector: list):
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        if len(self._lru) > self._LRU_MAX:
+            self._lru.popitem(last=False)
+
+    def embed_query(self, text: str) -> list:
+        key = self._key(text)
+        vector = self._get(key)
+        if vector is None:
+            vector = self._inner.embed_query(text)
+            self._put(key, vector)
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[list]:
+        keys = [self._key(t) for t in texts]
+        vectors = [self._get(k) for k in keys]
+
+        # N'embedder que les textes absents du cache, en un seul batch
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            fresh = self._inner.embed_documents([texts[i] for i in missing])
+            for i, vector in zip(missing, fresh):
+                vectors[i] = vector
+                self._put(keys[i], vector)
+
+        return vectors
+
 
 class RAGEngine:
     """Gestion de l'indexation vectorielle et de la recherche"""
@@ -26,24 +150,56 @@ class RAGEngine:
         
         # Clé API OpenAI
         api_key = os.getenv("OPENAI_API_KEY") or ""
-        
-        # Embeddings
-        self.embeddings = OpenAIEmbeddings(
-            model=config.embedding_model,
-            openai_api_key=api_key
+
+        # Connexion HTTP persistante partagée par embeddings et LLM
+        global _HTTP_CLIENT
+        if _HTTP_CLIENT is None:
+            _HTTP_CLIENT = _shared_http_client()
+
+        # Embeddings, derrière un cache LRU + disque par hash de texte
+        self.embeddings = CachedEmbeddings(
+            OpenAIEmbeddings(
+                model=config.embedding_model,
+                openai_api_key=api_key,
+                http_client=_HTTP_CLIENT
+            ),
+            Path(config.rag_index_path),
+            config.embedding_model
         )
-        
+
         # LLM pour génération
         self.llm = ChatOpenAI(
             model=config.llm_model,
             temperature=config.llm_temperature,
             max_tokens=config.llm_max_tokens,
-            openai_api_key=api_key
+            openai_api_key=api_key,
+            http_client=_HTTP_CLIENT
         )
         
         # Vectorstore
         self.vectorstore: Optional[FAISS] = None
         self.documents: List[Document] = []
+
+        # Encodeur de tokens (résolu paresseusement au premier contexte)
+        self._token_encoder = None
+
+        # Vues SoA sur les métadonnées (construites à la demande)
+        self._doc_arrays_cache = None
+
+        # Premier étage binaire (construit lors de l'indexation IVF-PQ)
+        self._binary_index = None
+        self._doc_vectors = None
+        self._doc_scales = None
+
+        # True si l'index vectoriel courant est mappé en lecture seule
+        # (chargement mmap au démarrage): toute mutation doit d'abord le
+        # relire en copie RAM écrivable
+        self._index_mmapped = False
+
+        # True si l'index stocke des vecteurs normalisés en métrique
+        # produit scalaire (le score est alors un cosinus, plus grand =
+        # plus proche, filtré par config.similarity_threshold)
+        self._normalized_ip = False
         
         # Charger l'index existant au démarrage
         self._load_persisted_index()
@@ -57,26 +213,427 @@ class RAGEngine:
             save_to_disk: Si True, sauvegarde l'index sur disque après indexation
         """
         self.documents = documents
-        
+
         if not documents:
             print("⚠️  Aucun document à indexer")
             return
-        
+
+        # Le corpus change: les structures deux étages d'un précédent
+        # build IVF-PQ ne correspondent plus aux positions des documents
+        self._clear_two_stage()
+
         # Créer ou mettre à jour le vectorstore
         if self.vectorstore is None:
-            self.vectorstore = FAISS.from_documents(
-                documents=documents,
-                embedding=self.embeddings
-            )
+            self.vectorstore = self._build_hnsw_vectorstore(documents)
+            if self.vectorstore is None:
+                # Repli: index Flat par défaut de LangChain (scan exhaustif)
+                self.vectorstore = FAISS.from_documents(
+                    documents=documents,
+                    embedding=self.embeddings
+                )
         else:
+            self._ensure_writable_index()
             self.vectorstore.add_documents(documents)
-        
+
         print(f"✓ {len(documents)} documents indexés")
         
         # Sauvegarder sur disque si demandé
         if save_to_disk:
             self.save_index()
     
+    def _clear_two_stage(self):
+        """Invalide le premier étage binaire et ses vecteurs int8
+
+        Les candidats de l'étage binaire sont des positions dans le
+        corpus au moment du build IVF-PQ: toute mutation de l'index
+        (ajout, mise à jour incrémentale, ré-indexation) les rendrait
+        silencieusement faux. Le prochain build IVF-PQ les reconstruit.
+        """
+        self._binary_index = None
+        self._doc_vectors = None
+        self._doc_scales = None
+
+    def _build_hnsw_vectorstore(self, documents: List[Document]) -> Optional[FAISS]:
+        """
+        Construit un vectorstore sur un index HNSW explicite
+
+        L'index Flat par défaut de FAISS.from_documents scanne tous les
+        vecteurs à chaque requête (O(N·d)); HNSW navigue un graphe de
+        voisinage en ~O(log N). La largeur de recherche est exposée via
+        config.rag_ef_search.
+
+        Args:
+            documents: Liste de documents LangChain
+
+        Returns:
+            Vectorstore FAISS, ou None si la construction échoue
+        """
+        try:
+            import faiss
+            import numpy as np
+            from langchain_community.docstore.in_memory import InMemoryDocstore
+
+            texts = [doc.page_content for doc in documents]
+            xb = np.asarray(self._embed_texts(texts), dtype="float32")
+
+            # Vecteurs normalisés + métrique produit scalaire: le score
+            # devient directement un cosinus (monotone, pas de sqrt)
+            faiss.normalize_L2(xb)
+            index = self._make_index(xb)
+            self._normalized_ip = True
+
+            from langchain_community.vectorstores.utils import DistanceStrategy
+
+            docstore = InMemoryDocstore({str(i): doc for i, doc in enumerate(documents)})
+            return FAISS(
+                embedding_function=self.embeddings,
+                index=self._maybe_to_gpu(index),
+                docstore=docstore,
+                index_to_docstore_id={i: str(i) for i in range(len(documents))},
+                normalize_L2=True,
+                distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT
+            )
+        except Exception as e:
+            print(f"⚠️  Index HNSW indisponible ({e}), index Flat par défaut")
+            return None
+
+    def _embed_texts(self, texts: List[str]) -> List[list]:
+        """
+        Embedde une liste de textes en batches parallèles
+
+        Un seul appel synchrone sérialise toute l'ingestion derrière le
+        réseau; ici les textes partent en batches de
+        config.embed_batch_size lancés de front (asyncio.gather), les
+        latences HTTP se recouvrent. Repli sur l'appel synchrone si
+        l'async échoue.
+
+        Args:
+            texts: Contenus à embedder
+
+        Returns:
+            Embeddings dans l'ordre des textes
+        """
+        batch_size = getattr(self.config, 'embed_batch_size', 128)
+        if len(texts) <= batch_size:
+            return self.embeddings.embed_documents(texts)
+
+        try:
+            import asyncio
+
+            batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+            print(f"🔄 Embedding de {len(texts)} chunks en {len(batches)} batches parallèles")
+
+            async def _run():
+                parts = await asyncio.gather(
+                    *[self.embeddings.aembed_documents(b) for b in batches]
+                )
+                return [vector for part in parts for vector in part]
+
+            return asyncio.run(_run())
+        except Exception as e:
+            print(f"⚠️  Embedding asynchrone indisponible ({e}), passe synchrone")
+            return self.embeddings.embed_documents(texts)
+
+    def _make_index(self, xb):
+        """
+        Construit l'index FAISS selon config.index_quantization
+
+        "sq8" quantifie les vecteurs stockés en int8 (2× moins d'octets
+        lus par requête), "pq" les compresse par quantification produit
+        (8×), "fp32" garde un HNSW sur vecteurs pleins. La recherche
+        étant limitée par la bande passante mémoire, moins d'octets par
+        vecteur = plus de requêtes par seconde, pour une perte de rappel
+        négligeable à ces dimensions.
+
+        Args:
+            xb: Matrice (N, d) des embeddings float32
+
+        Returns:
+            Index FAISS entraîné et rempli
+        """
+        import faiss
+
+        d = xb.shape[1]
+        quantization = getattr(self.config, 'index_quantization', 'fp32')
+
+        if quantization == "sq8":
+            index = faiss.IndexScalarQuantizer(
+                d, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+            )
+            index.train(xb)
+        elif quantization == "pq":
+            index = faiss.IndexPQ(d, max(1, d // 8), 8, faiss.METRIC_INNER_PRODUCT)
+            index.train(xb)
+        else:
+            index = faiss.IndexHNSWFlat(d, 32, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = 200
+            index.hnsw.efSearch = getattr(self.config, 'rag_ef_search', 64)
+
+        index.add(xb)
+        return index
+
+    def index_paths(self, file_paths: List[str], save_to_disk: bool = True) -> List[Document]:
+        """
+        Ingestion de bout en bout: parsing parallèle puis indexation batchée
+
+        Le parsing des fichiers (CPU-bound) passe par le pool de processus
+        de DocumentProcessor — un fichier par coeur — et l'embedding des
+        chunks par les batches asynchrones de _embed_texts: l'ingestion
+        scale quasi linéairement avec les coeurs disponibles.
+
+        Args:
+            file_paths: Chemins des fichiers à ingérer
+            save_to_disk: Si True, sauvegarde l'index après indexation
+
+        Returns:
+            Les documents chunkés qui ont été indexés
+        """
+        from src.document_processor import DocumentProcessor
+
+        documents = DocumentProcessor(self.config).process_documents(file_paths)
+        self.index_documents(documents, save_to_disk=save_to_disk)
+        return documents
+
+    def index_precomputed(self, documents: List[Document], vectors: List[List[float]],
+                          save_to_disk: bool = True):
+        """
+        Indexe des documents dont les embeddings sont déjà calculés
+
+        Évite de ré-embedder des chunks dont les vecteurs existent déjà
+        (par exemple calculés en une seule passe batchée lors de l'archivage).
+
+        Args:
+            documents: Liste de documents LangChain
+            vectors: Embeddings correspondants (même ordre que documents)
+            save_to_disk: Si True, sauvegarde l'index sur disque après indexation
+        """
+        self.documents = documents
+
+        if not documents:
+            print("⚠️  Aucun document à indexer")
+            return
+
+        self._clear_two_stage()
+
+        text_embeddings = [
+            (doc.page_content, vector)
+            for doc, vector in zip(documents, vectors)
+        ]
+        metadatas = [doc.metadata for doc in documents]
+
+        if self.vectorstore is None:
+            self.vectorstore = FAISS.from_embeddings(
+                text_embeddings=text_embeddings,
+                embedding=self.embeddings,
+                metadatas=metadatas
+            )
+        else:
+            self._ensure_writable_index()
+            self.vectorstore.add_embeddings(text_embeddings, metadatas=metadatas)
+
+        print(f"✓ {len(documents)} documents indexés (embeddings précalculés)")
+
+        if save_to_disk:
+            self.save_index()
+
+    @staticmethod
+    def _maybe_to_gpu(index):
+        """
+        Déplace l'index FAISS sur GPU si une build GPU de faiss et un
+        périphérique CUDA sont disponibles (recherche ~3× plus rapide).
+        Retourne l'index inchangé sinon (build CPU, pas de GPU...).
+        """
+        try:
+            import faiss
+            if hasattr(faiss, "StandardGpuResources") and faiss.get_num_gpus() > 0:
+                res = faiss.StandardGpuResources()
+                return faiss.index_cpu_to_gpu(res, 0, index)
+        except Exception as e:
+            print(f"⚠️  Index FAISS maintenu sur CPU: {e}")
+        return index
+
+    @staticmethod
+    def _to_cpu(index):
+        """Ramène un index GPU sur CPU (nécessaire pour l'écriture disque)"""
+        try:
+            import faiss
+            if hasattr(faiss, "GpuIndex") and isinstance(index, faiss.GpuIndex):
+                return faiss.index_gpu_to_cpu(index)
+        except Exception:
+            pass
+        return index
+
+    @staticmethod
+    def _chunk_id(doc: Document) -> int:
+        """ID 63 bits stable dérivé du hash SHA-256 du contenu du chunk"""
+        import hashlib
+        digest = hashlib.sha256(doc.page_content.encode('utf-8')).digest()
+        return int.from_bytes(digest[:8], 'little') & 0x7FFFFFFFFFFFFFFF
+
+    def index_documents_ivfpq(self, documents: List[Document], save_to_disk: bool = True):
+        """
+        Indexe les documents dans un index FAISS IVF-PQ (recherche sous-linéaire)
+
+        Contrairement à l'index Flat par défaut (scan exhaustif de tous les
+        vecteurs), IVF-PQ partitionne l'espace en nlist cellules et compresse
+        les vecteurs par quantification produit. Adapté aux gros corpus
+        archivés; le nombre de cellules sondées est config.rag_nprobe.
+
+        Chaque chunk est indexé sous un ID dérivé du hash de son contenu;
+        si un index existe déjà sur disque, seuls les chunks nouveaux sont
+        embeddés et ajoutés (et les chunks disparus retirés) au lieu de
+        reconstruire l'index entier.
+
+        Args:
+            documents: Liste de documents LangChain
+            save_to_disk: Si True, sauvegarde l'index sur disque après indexation
+        """
+        if not documents:
+            print("⚠️  Aucun document à indexer")
+            return
+
+        import faiss
+        import numpy as np
+        from langchain_community.docstore.in_memory import InMemoryDocstore
+
+        # ID stable par chunk (dédupliqué par contenu)
+        current = {self._chunk_id(doc): doc for doc in documents}
+        ids_file = Path(self.config.rag_index_path) / "indexed_ids.json"
+
+        # Mise à jour incrémentale si un index existe déjà sur disque
+        if self._try_incremental_update(current, ids_file):
+            self.documents = list(current.values())
+            if save_to_disk:
+                self.save_index()
+            return
+
+        # Reconstruction complète: embedder tous les chunks en une seule passe
+        self.documents = list(current.values())
+
+        # L'entraînement IVF-PQ exige plus de points que de centroïdes:
+        # sur un très petit corpus (run de quelques PDF), repli sur
+        # l'index standard plutôt qu'un RuntimeError faiss
+        if len(self.documents) < 16:
+            print(f"⚠️  Corpus trop petit pour IVF-PQ ({len(self.documents)} chunks), index standard")
+            self.index_documents(self.documents, save_to_disk=save_to_disk)
+            return
+
+        texts = [doc.page_content for doc in self.documents]
+        vectors = self._embed_texts(texts)
+        xb = np.asarray(vectors, dtype="float32")
+        d = xb.shape[1]
+
+        # Paramètres IVF-PQ: nlist ~ 4*sqrt(N), sous-vecteurs de 8 dimensions.
+        # 2^nbits centroïdes par sous-quantificateur doivent s'entraîner sur
+        # au moins autant de points: nbits est réduit pour les petits corpus
+        nlist = max(1, min(int(4 * len(self.documents) ** 0.5), len(self.documents)))
+        m = max(1, d // 8)
+        nbits = max(1, min(8, len(self.documents).bit_length() - 1))
+
+        quantizer = faiss.IndexFlatL2(d)
+        index = faiss.IndexIVFPQ(quantizer, d, nlist, m, nbits)
+        index.train(xb)
+        index.add_with_ids(xb, np.asarray(list(current.keys()), dtype="int64"))
+        index.nprobe = getattr(self.config, 'rag_nprobe', 8)
+
+        # Premier étage binaire: 1 bit par dimension, distance de Hamming.
+        # Pour le re-classement, les vecteurs sont quantifiés en int8 avec
+        # une échelle par vecteur: 4× moins de bande passante mémoire que
+        # FP32, perte de rappel négligeable sur des embeddings normalisés.
+        scales = np.abs(xb).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        self._doc_vectors = np.round(xb / scales[:, None]).astype(np.int8)
+        self._doc_scales = scales.astype("float32")
+        self._binary_index = faiss.IndexBinaryFlat(d)
+        self._binary_index.add(np.packbits((xb > 0).astype(np.uint8), axis=1))
+
+        # Envelopper dans le vectorstore LangChain
+        docstore = InMemoryDocstore({str(i): doc for i, doc in current.items()})
+        self.vectorstore = FAISS(
+            embedding_function=self.embeddings,
+            index=self._maybe_to_gpu(index),
+            docstore=docstore,
+            index_to_docstore_id={i: str(i) for i in current}
+        )
+
+        self._save_indexed_ids(current, ids_file)
+
+        print(f"✓ {len(self.documents)} documents indexés (IVF-PQ: nlist={nlist}, m={m}, nprobe={index.nprobe})")
+
+        # Sauvegarder sur disque si demandé
+        if save_to_disk:
+            self.save_index()
+
+    def _try_incremental_update(self, current: Dict[int, Document], ids_file: Path) -> bool:
+        """
+        Met à jour l'index IVF-PQ persisté par différence de contenu
+
+        Seuls les chunks nouveaux sont embeddés et ajoutés (add_with_ids),
+        les chunks disparus sont retirés (remove_ids): un ré-archivage
+        incrémental coûte O(ΔN) au lieu de O(N).
+
+        Args:
+            current: Mapping ID de chunk -> document
+            ids_file: Fichier sidecar listant les IDs déjà indexés
+
+        Returns:
+            True si la mise à jour incrémentale a réussi
+        """
+        index_file = Path(self.config.rag_index_path) / "rag_index.faiss"
+
+        if not ids_file.exists() or not index_file.exists():
+            return False
+
+        try:
+            import faiss
+            import numpy as np
+            from langchain_community.docstore.in_memory import InMemoryDocstore
+
+            previous_ids = set(json.loads(ids_file.read_text(encoding='utf-8')))
+            new_ids = [i for i in current if i not in previous_ids]
+            stale_ids = [i for i in previous_ids if i not in current]
+
+            # Relire l'index en écriture (le chargement au démarrage est
+            # mappé en lecture seule)
+            index = faiss.read_index(str(index_file))
+
+            if stale_ids:
+                index.remove_ids(np.asarray(stale_ids, dtype="int64"))
+
+            if new_ids:
+                texts = [current[i].page_content for i in new_ids]
+                xb = np.asarray(self.embeddings.embed_documents(texts), dtype="float32")
+                index.add_with_ids(xb, np.asarray(new_ids, dtype="int64"))
+
+            index.nprobe = getattr(self.config, 'rag_nprobe', 8)
+
+            docstore = InMemoryDocstore({str(i): doc for i, doc in current.items()})
+            self.vectorstore = FAISS(
+                embedding_function=self.embeddings,
+                index=self._maybe_to_gpu(index),
+                docstore=docstore,
+                index_to_docstore_id={i: str(i) for i in current}
+            )
+
+            self._save_indexed_ids(current, ids_file)
+
+            # Les candidats du premier étage binaire sont positionnels:
+            # après réordonnancement du corpus ils seraient faux
+            self._clear_two_stage()
+
+            print(f"✓ Index mis à jour incrémentalement (+{len(new_ids)} / -{len(stale_ids)} chunks)")
+            return True
+
+        except Exception as e:
+            print(f"⚠️  Mise à jour incrémentale impossible ({e}), reconstruction complète")
+            return False
+
+    @staticmethod
+    def _save_indexed_ids(current: Dict[int, Document], ids_file: Path):
+        """Sauvegarde le sidecar des IDs de chunks présents dans l'index"""
+        ids_file.parent.mkdir(exist_ok=True, parents=True)
+        ids_file.write_text(json.dumps(list(current.keys())), encoding='utf-8')
+
     def save_index(self, index_name: str = "rag_index"):
         """
         Sauvegarde l'index RAG sur disque
@@ -92,26 +649,192 @@ class RAGEngine:
             index_path = Path(self.config.rag_index_path)
             index_path.mkdir(exist_ok=True, parents=True)
             
-            # Sauvegarder l'index FAISS
-            self.vectorstore.save_local(
-                folder_path=str(index_path),
-                index_name=index_name
-            )
-            
-            # Sauvegarder les métadonnées des documents
-            import pickle
-            documents_file = index_path / f"{index_name}_documents.pkl"
-            with open(documents_file, 'wb') as f:
-                pickle.dump(self.documents, f)
+            # Sauvegarder l'index FAISS (repasser sur CPU le temps de
+            # l'écriture si l'index vit sur GPU)
+            live_index = self.vectorstore.index
+            self.vectorstore.index = self._to_cpu(live_index)
+            try:
+                self.vectorstore.save_local(
+                    folder_path=str(index_path),
+                    index_name=index_name
+                )
+            finally:
+                self.vectorstore.index = live_index
             
+            # Sauvegarder les documents en colonnes (Arrow) plutôt qu'en
+            # pickle: lecture zéro-copie, pas de désérialisation objet
+            # par objet au chargement
+            self._save_documents(index_path, index_name)
+
+            # Sidecar de métadonnées d'index: permet au chargement de
+            # savoir si les vecteurs sont normalisés (métrique produit
+            # scalaire) ou bruts (L2)
+            (index_path / f"{index_name}_meta.json").write_text(
+                json.dumps({"normalized_ip": self._normalized_ip}),
+                encoding='utf-8'
+            )
+
+            # Vecteurs de re-classement du premier étage binaire (int8 +
+            # échelles), rechargés en mmap
+            if self._doc_vectors is not None:
+                import numpy as np
+                np.save(index_path / f"{index_name}_vectors.npy", self._doc_vectors)
+                np.save(index_path / f"{index_name}_scales.npy", self._doc_scales)
+
             print(f"💾 Index RAG sauvegardé dans: {index_path}")
             print(f"   - {index_name}.faiss (index vectoriel)")
             print(f"   - {index_name}.pkl (docstore)")
-            print(f"   - {index_name}_documents.pkl (métadonnées)")
+            print(f"   - {index_name}_documents.arrow (métadonnées)")
             
         except Exception as e:
             print(f"❌ Erreur lors de la sauvegarde de l'index: {e}")
     
+    def _save_documents(self, index_path: Path, index_name: str):
+        """Écrit les documents dans un fichier Arrow (repli pickle)"""
+        try:
+            import pyarrow as pa
+            import pyarrow.feather as feather
+
+            table = pa.table({
+                "text": [doc.page_content for doc in self.documents],
+                "metadata": [json.dumps(doc.metadata) for doc in self.documents],
+            })
+            feather.write_feather(table, str(index_path / f"{index_name}_documents.arrow"))
+        except Exception as e:
+            print(f"⚠️  Écriture Arrow impossible ({e}), repli pickle")
+            with open(index_path / f"{index_name}_documents.pkl", 'wb') as f:
+                pickle.dump(self.documents, f)
+
+    def _load_documents(self, index_path: Path, index_name: str) -> List[Document]:
+        """Recharge les documents depuis le fichier Arrow (ou pickle legacy)"""
+        arrow_file = index_path / f"{index_name}_documents.arrow"
+        if arrow_file.exists():
+            try:
+                import pyarrow.feather as feather
+
+                table = feather.read_table(str(arrow_file))
+                return [
+                    Document(page_content=text, metadata=json.loads(metadata))
+                    for text, metadata in zip(
+                        table.column("text").to_pylist(),
+                        table.column("metadata").to_pylist()
+                    )
+                ]
+            except Exception as e:
+                print(f"⚠️  Lecture Arrow impossible ({e})")
+
+        documents_file = index_path / f"{index_name}_documents.pkl"
+        if documents_file.exists():
+            with open(documents_file, 'rb') as f:
+                return pickle.load(f)
+
+        return []
+
+    def _load_rerank_vectors(self, index_path: Path, index_name: str):
+        """Recharge les vecteurs de re-classement int8 en mmap (lazy paging)"""
+        vectors_file = index_path / f"{index_name}_vectors.npy"
+        scales_file = index_path / f"{index_name}_scales.npy"
+        if not vectors_file.exists() or not scales_file.exists():
+            return
+        try:
+            import faiss
+            import numpy as np
+            vectors = np.load(vectors_file, mmap_mode="r")
+            scales = np.load(scales_file, mmap_mode="r")
+            # Les candidats du premier étage sont des positions dans
+            # self.documents: des .npy d'un build précédent seraient faux
+            if len(vectors) != len(self.documents):
+                print("⚠️  Vecteurs de re-classement désalignés avec le corpus, ignorés")
+                return
+            # Reconstruire l'étage binaire à partir des bits de signe:
+            # les échelles étant positives, les signes int8 sont ceux
+            # des vecteurs fp32 d'origine
+            binary_index = faiss.IndexBinaryFlat(vectors.shape[1])
+            binary_index.add(np.packbits((np.asarray(vectors) > 0).astype(np.uint8), axis=1))
+            self._doc_vectors = vectors
+            self._doc_scales = scales
+            self._binary_index = binary_index
+        except Exception as e:
+            print(f"⚠️  Vecteurs de re-classement non rechargés: {e}")
+
+    def _load_vectorstore(self, index_path: Path, index_name: str) -> FAISS:
+        """
+        Charge le vectorstore depuis le disque en mappant l'index FAISS
+        en mémoire virtuelle (mmap) plutôt qu'en le copiant dans la RAM
+        du processus: seules les pages réellement consultées sont chargées.
+        Repli sur le chargement classique si le mmap échoue.
+
+        Args:
+            index_path: Dossier contenant l'index
+            index_name: Nom de l'index à charger
+
+        Returns:
+            Vectorstore FAISS chargé
+        """
+        # Métadonnées d'index (métrique) écrites à la sauvegarde
+        meta_file = index_path / f"{index_name}_meta.json"
+        try:
+            self._normalized_ip = json.loads(
+                meta_file.read_text(encoding='utf-8')
+            ).get("normalized_ip", False)
+        except Exception:
+            self._normalized_ip = False
+
+        try:
+            import faiss
+
+            index = faiss.read_index(
+                str(index_path / f"{index_name}.faiss"),
+                faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+            )
+            with open(index_path / f"{index_name}.pkl", 'rb') as f:
+                docstore, index_to_docstore_id = pickle.load(f)
+
+            kwargs = {}
+            if self._normalized_ip:
+                from langchain_community.vectorstores.utils import DistanceStrategy
+                kwargs = {
+                    "normalize_L2": True,
+                    "distance_strategy": DistanceStrategy.MAX_INNER_PRODUCT
+                }
+
+            self._index_mmapped = True
+            return FAISS(
+                embedding_function=self.embeddings,
+                index=self._maybe_to_gpu(index),
+                docstore=docstore,
+                index_to_docstore_id=index_to_docstore_id,
+                **kwargs
+            )
+
+        except Exception:
+            self._index_mmapped = False
+            return FAISS.load_local(
+                folder_path=str(index_path),
+                embeddings=self.embeddings,
+                index_name=index_name,
+                allow_dangerous_deserialization=True
+            )
+
+    def _ensure_writable_index(self, index_name: str = "rag_index"):
+        """
+        Relit l'index en copie RAM écrivable s'il est mappé en lecture seule
+
+        Le chargement au démarrage passe par mmap en lecture seule; y
+        ajouter des vecteurs est interdit par faiss. Appelé avant toute
+        mutation de l'index (coût payé une seule fois par processus).
+        """
+        if not self._index_mmapped or self.vectorstore is None:
+            return
+        try:
+            import faiss
+
+            index_file = Path(self.config.rag_index_path) / f"{index_name}.faiss"
+            self.vectorstore.index = faiss.read_index(str(index_file))
+            self._index_mmapped = False
+        except Exception as e:
+            print(f"⚠️  Rechargement écrivable de l'index impossible: {e}")
+
     def _load_persisted_index(self, index_name: str = "rag_index"):
         """
         Charge automatiquement l'index RAG persisté au démarrage
@@ -125,21 +848,13 @@ class RAGEngine:
             
             if not index_file.exists():
                 return False
+
+            # Charger l'index FAISS (mmap si possible)
+            self.vectorstore = self._load_vectorstore(index_path, index_name)
             
-            # Charger l'index FAISS
-            self.vectorstore = FAISS.load_local(
-                folder_path=str(index_path),
-                embeddings=self.embeddings,
-                index_name=index_name,
-                allow_dangerous_deserialization=True
-            )
-            
-            # Charger les métadonnées des documents
-            import pickle
-            documents_file = index_path / f"{index_name}_documents.pkl"
-            if documents_file.exists():
-                with open(documents_file, 'rb') as f:
-                    self.documents = pickle.load(f)
+            # Charger les métadonnées des documents (Arrow ou pickle legacy)
+            self.documents = self._load_documents(index_path, index_name)
+            self._load_rerank_vectors(index_path, index_name)
             
             print(f"✅ Index FAISS restauré: {len(self.documents)} documents chargés")
             return True
@@ -165,21 +880,13 @@ class RAGEngine:
             if not index_file.exists():
                 print(f"⚠️  Aucun index trouvé dans {index_path}")
                 return False
+
+            # Charger l'index FAISS (mmap si possible)
+            self.vectorstore = self._load_vectorstore(index_path, index_name)
             
-            # Charger l'index FAISS
-            self.vectorstore = FAISS.load_local(
-                folder_path=str(index_path),
-                embeddings=self.embeddings,
-                index_name=index_name,
-                allow_dangerous_deserialization=True
-            )
-            
-            # Charger les métadonnées des documents
-            import pickle
-            documents_file = index_path / f"{index_name}_documents.pkl"
-            if documents_file.exists():
-                with open(documents_file, 'rb') as f:
-                    self.documents = pickle.load(f)
+            # Charger les métadonnées des documents (Arrow ou pickle legacy)
+            self.documents = self._load_documents(index_path, index_name)
+            self._load_rerank_vectors(index_path, index_name)
             
             print(f"✅ Index RAG chargé depuis: {index_path}")
             print(f"   ✓ {len(self.documents)} documents chargés")
@@ -208,8 +915,11 @@ class RAGEngine:
             }
         )
         
-        # Indexer
+        # Indexer (le premier étage binaire ne connaît pas ce nouveau
+        # chunk: le désactiver pour qu'il reste atteignable)
         if self.vectorstore:
+            self._ensure_writable_index()
+            self._clear_two_stage()
             self.vectorstore.add_documents([doc])
         
         # Sauvegarder en mémoire persistante
@@ -228,30 +938,183 @@ class RAGEngine:
         """
         if not self.vectorstore:
             return []
-        
+
         k = k or self.config.top_k_retrieval
-        
+
+        # Recherche en deux étages si l'index binaire est disponible
+        if self._binary_index is not None:
+            return self._retrieve_two_stage(query, k)
+
         # Recherche avec scores de similarité
         results = self.vectorstore.similarity_search_with_score(query, k=k)
-        
+        if not results:
+            return []
+
         # Filtrer les résultats faibles (score > 1.5 pour cosine distance)
-        filtered_results = [
-            doc for doc, score in results if score < 1.5
-        ]
-        
-        return filtered_results
+        # via un masque numpy: une comparaison C au lieu de k tests Python
+        import numpy as np
+
+        scores = np.fromiter((s for _, s in results), dtype="float32", count=len(results))
+        if self._normalized_ip:
+            keep = np.flatnonzero(scores > getattr(self.config, 'similarity_threshold', 0.6))
+        else:
+            keep = np.flatnonzero(scores < 1.5)
+        return [results[i][0] for i in keep]
     
+    def retrieve_by_vector(self, vector, k: Optional[int] = None) -> List[Document]:
+        """
+        Recherche à partir d'un embedding déjà calculé
+
+        Évite de ré-embedder la requête quand son vecteur existe déjà
+        (cache d'embeddings, chemins batch).
+
+        Args:
+            vector: Embedding de la requête
+            k: Nombre de résultats (défaut: config.top_k_retrieval)
+
+        Returns:
+            Liste des documents pertinents
+        """
+        if not self.vectorstore:
+            return []
+
+        k = k or self.config.top_k_retrieval
+        results = self.vectorstore.similarity_search_with_score_by_vector(vector, k=k)
+        if self._normalized_ip:
+            return [
+                doc for doc, score in results
+                if score > getattr(self.config, 'similarity_threshold', 0.6)
+            ]
+        return [doc for doc, score in results if score < 1.5]
+
+    def retrieve_batch(self, queries: List[str], k: Optional[int] = None) -> List[List[Document]]:
+        """
+        Recherche pour plusieurs requêtes en une seule passe FAISS
+
+        Les requêtes sont embeddées en un seul appel batché puis soumises
+        ensemble à l'index: N produits matrice-vecteur deviennent un seul
+        produit matriciel (BLAS), bien mieux vectorisé.
+
+        Args:
+            queries: Requêtes de recherche
+            k: Nombre de résultats par requête (défaut: config.top_k_retrieval)
+
+        Returns:
+            Une liste de documents pertinents par requête
+        """
+        if not self.vectorstore or not queries:
+            return [[] for _ in queries]
+
+        import numpy as np
+
+        k = k or self.config.top_k_retrieval
+        xq = np.asarray(self.embeddings.embed_documents(queries), dtype="float32")
+        if self._normalized_ip:
+            import faiss
+            faiss.normalize_L2(xq)
+        scores, ids = self.vectorstore.index.search(xq, k)
+
+        index_to_id = self.vectorstore.index_to_docstore_id
+        docstore = self.vectorstore.docstore
+
+        # Masque vectorisé sur toute la matrice de scores, puis seules
+        # les positions retenues repassent en Python
+        if self._normalized_ip:
+            mask = (ids != -1) & (scores > getattr(self.config, 'similarity_threshold', 0.6))
+        else:
+            mask = (ids != -1) & (scores < 1.5)
+
+        results = []
+        for row_ids, row_mask in zip(ids, mask):
+            docs = []
+            for i in row_ids[row_mask]:
+                doc = docstore.search(index_to_id[int(i)])
+                if isinstance(doc, Document):
+                    docs.append(doc)
+            results.append(docs)
+
+        return results
+
+    def _retrieve_two_stage(self, query: str, k: int) -> List[Document]:
+        """
+        Recherche en deux étages: génération de candidats par distance de
+        Hamming sur les vecteurs binarisés (1 bit/dim, 32× moins de RAM),
+        puis re-classement des candidats par produit scalaire sur les
+        vecteurs int8 déquantifiés
+
+        Args:
+            query: Requête de recherche
+            k: Nombre de résultats finaux
+
+        Returns:
+            Liste des documents pertinents
+        """
+        import numpy as np
+
+        xq = np.asarray(self.embeddings.embed_query(query), dtype="float32")
+        bits = np.packbits((xq > 0).astype(np.uint8)).reshape(1, -1)
+
+        # Étage 1: top-200 candidats en distance de Hamming
+        n_candidates = min(200, self._binary_index.ntotal)
+        _, ids = self._binary_index.search(bits, n_candidates)
+        candidates = [i for i in ids[0] if i != -1]
+
+        if not candidates:
+            return []
+
+        # Étage 2: re-classement des candidats (int8 déquantifiés à la volée,
+        # seuls les ~200 candidats repassent en FP32)
+        cand_vecs = self._doc_vectors[candidates].astype(np.float32)
+        cand_vecs *= self._doc_scales[candidates, None]
+        scores = cand_vecs @ xq
+        order = np.argsort(-scores)[:k]
+
+        return [self.documents[candidates[i]] for i in order]
+
+    def _doc_arrays(self):
+        """
+        Vues SoA (structure of arrays) sur les métadonnées des documents
+
+        Les doc_type et sources sont extraits une fois dans deux tableaux
+        numpy parallèles: les filtres et agrégations deviennent des
+        comparaisons vectorisées au lieu d'un .metadata.get par document.
+        Invalidées dès que la liste de documents change.
+
+        Returns:
+            Tuple (types, sources) de tableaux numpy object
+        """
+        import numpy as np
+
+        # L'entrée retient la liste elle-même: tant qu'elle est en cache
+        # son id ne peut pas être recyclé, et l'identité (is) suffit
+        cached = self._doc_arrays_cache
+        if (
+            cached is not None
+            and cached[0] is self.documents
+            and len(cached[1]) == len(self.documents)
+        ):
+            return cached[1], cached[2]
+
+        types = np.array(
+            [doc.metadata.get("doc_type", "unknown") for doc in self.documents],
+            dtype=object
+        )
+        sources = np.array(
+            [doc.metadata.get("source", "unknown") for doc in self.documents],
+            dtype=object
+        )
+        self._doc_arrays_cache = (self.documents, types, sources)
+        return types, sources
+
     def retrieve_by_type(self, doc_type: str, k: int = 5) -> List[Document]:
-        """Recherche par type de document"""
+        """Recherche par type de document (masque vectorisé)"""
         if not self.documents:
             return []
-        
-        filtered = [
-            doc for doc in self.documents
-            if doc.metadata.get("doc_type") == doc_type
-        ]
-        
-        return filtered[:k]
+
+        import numpy as np
+
+        types, _ = self._doc_arrays()
+        return [self.documents[i] for i in np.flatnonzero(types == doc_type)[:k]]
     
     def generate_with_context(self, query: str, context_docs: List[Document]) -> dict:
         """
@@ -267,11 +1130,14 @@ class RAGEngine:
         # Construire le contexte
         context = self._build_context(context_docs)
         
-        # Construire le prompt
-        prompt = self._build_prompt(query, context)
-        
-        # Générer la réponse
-        response = self.llm.invoke(prompt)
+        # Générer la réponse: instructions invariantes en message système
+        # (cachées côté serveur), contexte et question en message humain
+        from langchain_core.messages import HumanMessage, SystemMessage
+
+        response = self.llm.invoke([
+            SystemMessage(content=_SYSTEM_PROMPT),
+            HumanMessage(content=f"CONTEXTE:\n{context}\n\nQUESTION: {query}\n\nRÉPONSE:")
+        ])
         
         return {
             "response": response.content,
@@ -279,35 +1145,77 @@ class RAGEngine:
             "sources": [doc.metadata.get("source") for doc in context_docs]
         }
     
+    def generate_with_context_stream(self, query: str, context_docs: List[Document]):
+        """
+        Génère une réponse en streaming (fragments de texte au fil de l'eau)
+
+        Le premier token part vers l'appelant dès qu'il est décodé au
+        lieu d'attendre la fin de la génération: latence perçue bien plus
+        faible dans l'interface, pour le même coût total.
+
+        Args:
+            query: Question ou instruction
+            context_docs: Documents de contexte
+
+        Yields:
+            Fragments de texte de la réponse
+        """
+        from langchain_core.messages import HumanMessage, SystemMessage
+
+        context = self._build_context(context_docs)
+        messages = [
+            SystemMessage(content=_SYSTEM_PROMPT),
+            HumanMessage(content=f"CONTEXTE:\n{context}\n\nQUESTION: {query}\n\nRÉPONSE:")
+        ]
+
+        for chunk in self.llm.stream(messages):
+            if chunk.content:
+                yield chunk.content
+
+    def _count_tokens(self, text: str) -> int:
+        """Compte les tokens d'un texte (approximation si tiktoken absent)"""
+        if self._token_encoder is None:
+            try:
+                import tiktoken
+                self._token_encoder = tiktoken.encoding_for_model(self.config.llm_model)
+            except Exception:
+                self._token_encoder = False
+        if self._token_encoder:
+            return len(self._token_encoder.encode(text))
+        return len(text) // 4
+
     def _build_context(self, documents: List[Document]) -> str:
-        """Construit le contexte depuis les documents récupérés"""
+        """Construit le contexte depuis les documents récupérés
+
+        La latence de préfill du LLM croît linéairement avec les tokens
+        d'entrée: chaque extrait est tronqué à config.max_ctx_chars et la
+        concaténation s'arrête dès que config.context_token_budget est
+        atteint, au lieu d'empiler tous les chunks récupérés.
+        """
+        budget = getattr(self.config, 'context_token_budget', 3000)
+        max_chars = getattr(self.config, 'max_ctx_chars', 4000)
+
         context_parts = []
-        
+        used = 0
+
         for i, doc in enumerate(documents, 1):
             source = doc.metadata.get("source", "Unknown")
-            content = doc.page_content
-            context_parts.append(
-                f"[Document {i} - {source}]\n{content}\n"
-            )
-        
+            part = f"[Document {i} - {source}]\n{doc.page_content[:max_chars]}\n"
+
+            used += self._count_tokens(part)
+            if context_parts and used > budget:
+                break
+            context_parts.append(part)
+
         return "\n---\n".join(context_parts)
     
     def _build_prompt(self, query: str, context: str) -> str:
-        """Construit le prompt pour le LLM"""
-        return f"""Tu es un assistant d'analyse financière. Réponds à la question en te basant UNIQUEMENT sur le contexte fourni.
+        """Construit le prompt pour le LLM (préambule fixe d'abord)
 
-CONTEXTE:
-{context}
-
-QUESTION: {query}
-
-INSTRUCTIONS:
-- Réponds de manière précise et factuelle
-- Cite les sources quand c'est pertinent
-- Si l'information n'est pas dans le contexte, dis "Information non disponible dans les documents"
-- Ne fais AUCUNE supposition ou hallucination
-
-RÉPONSE:"""
+        L'ordre préambule -> contexte -> question est volontaire: le
+        préfixe stable maximise les hits du cache de préfixe serveur.
+        """
+        return f"{_SYSTEM_PROMPT}\n\nCONTEXTE:\n{context}\n\nQUESTION: {query}\n\nRÉPONSE:"
     
     def _format_context(self, context_data: dict) -> str:
         """Formate le contexte manuel pour l'indexation"""
@@ -326,17 +1234,15 @@ RÉPONSE:"""
         """Retourne des statistiques sur les documents indexés"""
         if not self.documents:
             return {"total": 0}
-        
-        types = {}
-        sources = set()
-        
-        for doc in self.documents:
-            doc_type = doc.metadata.get("doc_type", "unknown")
-            types[doc_type] = types.get(doc_type, 0) + 1
-            sources.add(doc.metadata.get("source", "unknown"))
-        
+
+        # Agrégations vectorisées sur les vues SoA
+        import numpy as np
+
+        types, sources = self._doc_arrays()
+        values, counts = np.unique(types, return_counts=True)
+
         return {
             "total_chunks": len(self.documents),
-            "unique_sources": len(sources),
-            "types": types
+            "unique_sources": len(np.unique(sources)),
+            "types": dict(zip(values.tolist(), counts.tolist()))
         }
\ No newline at end of file